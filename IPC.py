@@ -1,52 +1,208 @@
+import heapq
+import itertools
+import os
 import subprocess
 import time
 import sys
-from threading  import Thread
+from threading  import Thread, Lock
 from Queue import Queue, Empty
+import messages
 refreshRate = 5 #Hz
 warn = False #set to True if you want warning messages to display
-def enqueue_output(out, queue): #puts output stream data onto a queue
+def enqueue_output(out, queue, proc=None): #puts output stream data onto a queue, tagged with the process it came from if proc is given
     for line in iter(out.readline, b''):
-        queue.put(line)
+        if proc is None:
+            queue.put(line)
+        else:
+            queue.put((proc, line))
     out.close()
 
+def enqueue_messages(out, queue, proc=None): #like enqueue_output, for streams of message frames
+    while True:
+        try:
+            message = messages.read_message(out)
+        except messages.MessageError as e:
+            sys.stderr.write(str(e) + '\n')
+            continue
+        if message is None:
+            break
+        if proc is None:
+            queue.put(message)
+        else:
+            queue.put((proc, message))
+    out.close()
+
+class Dispatcher: #lets one thread wait on several processes at once and handle their lines as soon as they arrive, and run timers in between
+    
+    def __init__(self):
+        self.q = Queue() #(process, line or message) pairs from every process created with this dispatcher
+        self.timers = [] #heap of [time, count, fct, args]
+        self.count = itertools.count() #orders timers due at the same time
+    def callLater(self, delay, fct, *args): #calls fct(*args) from wait() once delay seconds have passed. returns a timer for cancel()
+        timer = [time.time() + delay, next(self.count), fct, args]
+        heapq.heappush(self.timers, timer)
+        return timer
+    def cancel(self, timer): #stops a timer from being called. does nothing if timer is None or was already called
+        if timer is not None:
+            timer[2] = None
+    def runTimers(self): #calls the timers that are due. returns the number called
+        n = 0
+        while self.timers and self.timers[0][0] <= time.time():
+            timer = heapq.heappop(self.timers)
+            if timer[2] is not None:
+                fct, timer[2] = timer[2], None
+                fct(*timer[3])
+                n += 1
+        return n
+    def wait(self, timeout=None): #blocks until a line or message arrives from any process, a timer is due or timeout seconds pass, then handles everything that is waiting. returns the number of lines, messages and timers handled
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            n = self.runTimers()
+            if n:
+                return n + self.drain()
+            deadline = end
+            if self.timers and (deadline is None or self.timers[0][0] < deadline):
+                deadline = self.timers[0][0]
+            # Queue.get without a timeout can't be interrupted with Ctrl-C
+            remaining = 0.5 if deadline is None else deadline - time.time()
+            if remaining <= 0:
+                if deadline == end:
+                    return 0
+                continue
+            try:
+                item = self.q.get(timeout=min(remaining, 0.5))
+            except Empty:
+                continue
+            return self.drain(item)
+    def drain(self, item=None): #handles the given item and everything that is waiting. returns the number handled
+        n = 0
+        if item is None:
+            try: item = self.q.get_nowait()
+            except Empty:
+                return n
+        while True:
+            proc, data = item
+            proc.receive(data)
+            n += 1
+            try: item = self.q.get_nowait()
+            except Empty:
+                return n
+
 class process: #create one of these to do IPC
     
-    def __init__(self,usestd,var): #set usestd to true if you want to communicate through std in and out (this should be a child process in this case)
+    def __init__(self,usestd,var,dispatcher=None,framed=False,start=True): #set usestd to true if you want to communicate through std in and out (this should be a child process in this case). lines go to dispatcher instead of tryReadLine if one is given. set framed to true to exchange binary messages (see messages.py) instead of lines, on both ends. set start to false to spawn the child process later with start()
         self.usestd=usestd
-        if usestd==False:
-            self.p = subprocess.Popen(['python',var],-1,None,subprocess.PIPE,subprocess.PIPE) #spawns child process
+        self.var=var
+        self.dispatcher=dispatcher
+        self.framed=framed
+        if framed and usestd and sys.platform == 'win32':
+            # stdin and stdout are text mode on Windows, which would mangle frames
+            import msvcrt
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+            msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+        self.p = None
         self.q = Queue()
-        if usestd==True:
-            self.t = Thread(target=enqueue_output, args=(sys.stdin, self.q))#start looking for input and be ready to send output
+        self.writeLock = Lock() #heartbeats are sent from their own thread
+        self.lastHeartbeat = 0
+        self.line = ""
+        self.message = None #the last message read if framed
+        if start or usestd:
+            self.start()
+    def start(self): #spawns the child process (unless usestd) and starts reading from it. can be called again after stop() to restart it
+        if self.usestd==False:
+            self.p = subprocess.Popen(['python',self.var],-1,None,subprocess.PIPE,subprocess.PIPE) #spawns child process
+        if self.dispatcher is None:
+            args = (self.q,)
         else:
-            self.t = Thread(target=enqueue_output, args=(self.p.stdout, self.q))#start looking for input and be ready to send output
+            args = (self.dispatcher.q, self)
+        reader = enqueue_messages if self.framed else enqueue_output
+        if self.usestd==True:
+            self.t = Thread(target=reader, args=(sys.stdin,) + args)#start looking for input and be ready to send output
+        else:
+            self.t = Thread(target=reader, args=(self.p.stdout,) + args)#start looking for input and be ready to send output
         self.t.daemon = True # thread dies with the program
         self.t.start()
-        self.line = ""
-        
+    def isAlive(self): #whether the child process is running
+        return self.p is not None and self.p.poll() is None
+    def stop(self,timeout=0.5): #closes the child process's input, waits up to timeout seconds for it to exit and kills it if it hasn't
+        if self.p is None:
+            return
+        try: self.p.stdin.close()
+        except Exception:
+            pass
+        end = time.time() + timeout
+        while self.p.poll() is None and time.time() < end:
+            time.sleep(0.05)
+        if self.p.poll() is None:
+            try: self.p.kill()
+            except OSError: #it exited in the meantime
+                pass
+            self.p.wait()
+    def heartbeat(self,interval=0.25): #tells the parent this process is alive, at most every interval seconds. call this from the main loop of a framed child process
+        now = time.time()
+        if now - self.lastHeartbeat >= interval:
+            self.lastHeartbeat = now
+            self.send(messages.HEARTBEAT)
+    def startHeartbeat(self,interval=0.25): #sends heartbeats from a thread, for child processes whose main loop blocks
+        def beat():
+            while True:
+                self.heartbeat(interval)
+                time.sleep(interval)
+        t = Thread(target=beat)
+        t.daemon = True
+        t.start()
+
     def setOnReadLine(self,onReadLine):
         self.onRead = onReadLine
+    def receive(self,data): #stores a line or message that was read and calls the callback
+        if self.framed:
+            self.message = data
+        else:
+            self.line = data
+        self.onRead()
     def tryReadLine(self):
-        try: self.line = self.q.get_nowait() # or q.get(timeout=.1)
+        try: data = self.q.get_nowait() # or q.get(timeout=.1)
         except Empty:
             if warn:
                 sys.stderr.write('no output yet\n')
         else:
-            self.onRead()
-    def write(self,data): #data should always end with a new line ("\n")
-        if self.usestd==False:
-            try:
-                self.p.stdin.write(data)
-                self.p.stdin.flush()
-            except Exception:
-                sys.stderr.write('error writing to process\n')
-        else:
-            try:
-                sys.stdout.write(data)
-                sys.stdout.flush()
-            except Exception:
-                sys.stderr.write('error writing to process\n')
+            self.receive(data)
+    def readLine(self,timeout=None): #waits for the next line, up to timeout seconds. returns True if a line was read
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            # Queue.get without a timeout can't be interrupted with Ctrl-C
+            remaining = 0.5 if end is None else end - time.time()
+            if remaining <= 0:
+                return False
+            try: data = self.q.get(timeout=min(remaining, 0.5))
+            except Empty:
+                continue
+            self.receive(data)
+            return True
+    def readAll(self): #handles every line that is waiting. returns the number of lines read
+        n = 0
+        while True:
+            try: data = self.q.get_nowait()
+            except Empty:
+                return n
+            self.receive(data)
+            n += 1
+    def send(self,type,*fields): #sends a message, see messages.pack. the process must be framed
+        self.write(messages.pack(type, *fields))
+    def write(self,data): #data should always end with a new line ("\n") unless it is a frame
+        with self.writeLock:
+            if self.usestd==False:
+                try:
+                    self.p.stdin.write(data)
+                    self.p.stdin.flush()
+                except Exception:
+                    sys.stderr.write('error writing to process\n')
+            else:
+                try:
+                    sys.stdout.write(data)
+                    sys.stdout.flush()
+                except Exception:
+                    sys.stderr.write('error writing to process\n')
 
 #sets up initial time to sync from
 def InitSync():
@@ -6,6 +6,7 @@ import thread
 import sys
 import clr
 import numpy as np
+import skeleton_bus
 
 clr.AddReference('FTCHpy')
 import FTCHpy
@@ -39,6 +40,8 @@ personIDAttempts = {} #dictionary where a skeletonID is paired with the number o
 
 gestGivenPID = -1 #personID of the user who provided a gesture
 
+bus = skeleton_bus.SkeletonBus(create=True) #every tracked skeleton of every frame is published here for other processes
+
 lib.loop(track)
 
 MAX_GUESSES = 30 #maximum number of guesses the face identifier is allowed before a person is considered unrecognized
@@ -74,6 +77,11 @@ def detect_motion():
 		lock.acquire()
 		lib.loop(track)	 #grab a new 3D frame
 		lock.release()
+		for user in range(0,lib.getUsersCount(track)):
+			if lib.isUserTracked(track, user):
+				skeleton = lib.getUserID(track, user)
+				joints, confidence = skeleton_bus.read_skeleton(lib, track, user)
+				bus.publish(skeleton, curSkeletonPersonIDs.get(skeleton, -1), joints, confidence)
 		#TODO check for monotonic approach to new poses using functions in poses class
 		for user in range(0,lib.getUsersCount(track)):
 			if len(lstage)<=user:
@@ -236,7 +244,7 @@ def facialActions():
 				if (not (curSkeletonPersonIDs[key] == oldSkeletonPersonIDs[key])) and (personIDAttempts[key] < MAX_GUESSES): #if the personID changed for a given skeletonID
 					if curSkeletonPersonIDs[key] >= 0 and oldSkeletonPersonIDs[key] < 0:
 						#person is now recognized
-						p.write("face recognized " + str(key) + " " + str(curSkeletonPersonIDs[key]) + " " + str(time.time()) + "\n")
+						p.send(messages.FACE_RECOGNIZED, key, curSkeletonPersonIDs[key])
 						personIDAttempts[key] = MAX_GUESSES + 1
 						if curSkeletonPersonIDs[key] == followloss and pickupfollow:
 							userOfInt = key #follow last user followed
@@ -245,7 +253,7 @@ def facialActions():
 						sys.stderr.write("recognized skeleton: " + str(key) + " as person: " + str(curSkeletonPersonIDs[key]) + "\n")
 					elif curSkeletonPersonIDs[key] < 0 and oldSkeletonPersonIDs[key] >= 0:
 						#recognized person has left the frame
-						p.write("face lost " + str(key) + " " + str(oldSkeletonPersonIDs[key]) + " " + str(time.time()) + "\n")
+						p.send(messages.FACE_LOST, key, oldSkeletonPersonIDs[key])
 						sys.stderr.write("person: " + str(oldSkeletonPersonIDs[key]) + " has left vision as skeleton: " + str(key) + "\n")
 						deleteKeys.append(key)
 					elif curSkeletonPersonIDs[key] < 0 and oldSkeletonPersonIDs[key] < 0: #for different negative numbers showing up (any negative number is a failure to recognize
@@ -259,14 +267,14 @@ def facialActions():
 					personIDAttempts[key] = personIDAttempts[key] + 1 #attempt failed to identify user
 				elif personIDAttempts[key] == MAX_GUESSES:
 					#person was failed to be recognized
-					p.write("face unrecognized " + str(time.time()) + "\n")
+					p.send(messages.FACE_UNRECOGNIZED)
 					sys.stderr.write(" user is unrecognizable\n")
 					personIDAttempts[key] = personIDAttempts[key] + 1
 				elif personIDAttempts[key] > MAX_GUESSES:
 					if curSkeletonPersonIDs[key] == -5:
 						deleteKeys.append(key) #skeleton has used max guesses and then left the screen
 						if oldSkeletonPersonIDs[key] >= 0: #recognized person left
-							p.write("face lost " + str(key) + " " + str(oldSkeletonPersonIDs[key]) + " " + str(time.time()) + "\n")
+							p.send(messages.FACE_LOST, key, oldSkeletonPersonIDs[key])
 							sys.stderr.write("person: " + str(oldSkeletonPersonIDs[key]) + " has left vision as skeleton: " + str(key) + "\n")
 					curSkeletonPersonIDs[key] = oldSkeletonPersonIDs[key]
 				else:
@@ -275,7 +283,7 @@ def facialActions():
 				personIDAttempts[key] = personIDAttempts[key] + 1
 				if curSkeletonPersonIDs[key] >= 0:
 					#if face is recognized in one try (user comes on and is immediately recognized
-					p.write("face recognized " + str(key) + " " + str(curSkeletonPersonIDs[key]) + " " + str(time.time()) + "\n")
+					p.send(messages.FACE_RECOGNIZED, key, curSkeletonPersonIDs[key])
 					personIDAttempts[key] = MAX_GUESSES + 1
 					sys.stderr.write("recognized skeleton: " + str(key) + " as person: " + str(curSkeletonPersonIDs[key]) + "\n")
 					if curSkeletonPersonIDs[key] == followloss and pickupfollow:
@@ -427,7 +435,8 @@ def handleLine():
 	global follow
 	global stopfollow
 	global pickupfollow
-	if p.line == "follow\n": #follow command comes from master control because the follow speech command was given
+	command = p.message.fields[-1] if p.message.type == messages.COMMAND else ""
+	if command == "follow": #follow command comes from master control because the follow speech command was given
 		if lib.getUsersCount(track)>0:
 			lock.acquire()
 			userOfInt = lib.getUserID(track,0) #default to following user 0 regardless of recognition or number of users
@@ -436,38 +445,41 @@ def handleLine():
 			lock.release()
 		else:
 			sys.stderr.write("no users\n")
-	elif p.line == "follow stop\n": #follow stop command from master control because the stop command was given by speech
+	elif command == "follow stop": #follow stop command from master control because the stop command was given by speech
 		stopfollow = True
 		pickupfollow = False
 		follow = False
 		sys.stderr.write("got stop follow\n")
-	elif p.line == "sleep\n":
+	elif command == "sleep":
 		e.clear()  #pauses the other threads until ready for them to start again
-	elif p.line == "wake\n":
+	elif command == "wake":
 		e.set()	#allows other threads to continue
 	else:
-		sys.stderr.write("handle line " + p.line)
+		sys.stderr.write("handle message " + str(p.message) + "\n")
 
 thread.start_new_thread(detect_motion,()) #gesture recognition
 thread.start_new_thread(facialActions, ()) #face recognition
 
 sys.stderr.write("starting KM process\n")
 
-p = process(True,"KM")
+p = process(True,"KM",framed=True)
 p.setOnReadLine(handleLine)
 InitSync()
 e.set()
+p.startHeartbeat() #tell master controller that it is still running, even while a slow tick holds the lock
+p.send(messages.READY) #tell master controller that it has started
 
 while True:
 	p.tryReadLine()
 	lock.acquire()
 	if stopfollow:
-		p.write("follow stop "+str(time.time()) + "\n") #received command to stop following
+		p.send(messages.FOLLOW_STOP) #received command to stop following
 		follow = False
 		stopfollow = False
 	if quits:
-		p.write("quit " + str(gestGivenPID) + " " + str(time.time()) + "\n") #if person is unknown, master control/speaking program will handle
+		p.send(messages.GESTURE, messages.GESTURES.index("quit"), gestGivenPID) #if person is unknown, master control/speaking program will handle
 		gestGivenPID = -1 #reset it to an unknown person
+		p.send(messages.EXIT) #quitting on purpose, so the master controller doesn't restart it
 		exit()
 	if follow:
 		#sys.stderr.write(str(track) + " " + str(userOfInt) + "\n")
@@ -488,9 +500,9 @@ while True:
 						curSkeletonPersonIDs[userOfInt]=-1
 						stopfollow = True
 					else:
-						p.write("follow "+str(lib.getUserSkeletonTorsoZ(track,user)/1000)+" "+str(lib.getUserSkeletonTorsoX(track,user)/1000)+ " " + str(userOfInt) + " " + str(time.time()) + "\n")
+						p.send(messages.FOLLOW, lib.getUserSkeletonTorsoZ(track,user)/1000, lib.getUserSkeletonTorsoX(track,user)/1000, userOfInt)
 				else: #user is unrecognized, send anyways in case follow was started by voice command and let the master control handle. should not send skeletonID.
-					p.write("follow "+str(lib.getUserSkeletonTorsoZ(track,user)/1000)+" "+str(lib.getUserSkeletonTorsoX(track,user)/1000)+ " " + str(time.time()) + "\n")
+					p.send(messages.FOLLOW, lib.getUserSkeletonTorsoZ(track,user)/1000, lib.getUserSkeletonTorsoX(track,user)/1000, messages.NO_ID)
 			else:#they aren't tracked
 				stopfollow = True
 				
@@ -499,11 +511,11 @@ while True:
 			
 	if rightWave:
 		rightWave=False
-		p.write("rightWave " + str(gestGivenPID) + " " + str(time.time()) + "\n") #if person is unknown, master control/speaking program will handle
+		p.send(messages.GESTURE, messages.GESTURES.index("rightWave"), gestGivenPID) #if person is unknown, master control/speaking program will handle
 		gestGivenPID = -1 #reset it to an unknown person
 	if leftWave:
 		leftWave=False
-		p.write("leftWave " + str(gestGivenPID) + " " + str(time.time()) + "\n") #if person is unknown, master control/speaking program will handle
+		p.send(messages.GESTURE, messages.GESTURES.index("leftWave"), gestGivenPID) #if person is unknown, master control/speaking program will handle
 		gestGivenPID = -1 #reset it to an unknown person
 	lock.release()
 	
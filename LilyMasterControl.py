@@ -4,6 +4,8 @@
 import iRobotCreate
 import time
 import IPC
+import messages
+import supervisor
 import Queue
 import string
 import sys
@@ -24,7 +26,8 @@ from InteractiveStory import main
 #ax.set_xlim([-2,2])
 
 
-indivTime = [300.0]
+greetCooldown = 300.0 #seconds after being recognized before a person is greeted again
+greetAgainAt = {0: time.time() + greetCooldown} #personID -> time after which they are greeted when recognized
 
 # qGest is a Queue which holds commands for gestures sent from the Kinect monitor
 #	these commands are pulled off the queue when all processes are ready
@@ -44,7 +47,12 @@ gest = ""
 
 #When readyTT is False, the TTS program is busy and we must wait.
 # When readyTT is True, the TTS program can receive commands.
+# say() speaks and whenTTSReady() waits for the TTS
 readyTT=False
+ttsWaiters = [] #called once the TTS is ready, see whenTTSReady
+
+followTimeout = 0.6 #seconds without a follow command after which the user is considered lost
+followTimer = None #calls followLost if no follow command comes in time
 
 #holds the time of completion of the most recent movement
 lastMoveTime = time.time()
@@ -52,6 +60,9 @@ lastMoveTime = time.time()
 state = "waiting" #keep track of whether or not LILI is following a user
 voiceFollow = False #true if the follow command was received by voice and should follow regardless of recognition of user
 
+#True once VoiceMonitor has been told to start listening, so it can be told again if it is restarted
+voiceStarted = False
+
 #holds dictionary of recognized skeletonIDs and their personID
 skeletonPersonIDs = {-1:-1}
 
@@ -66,49 +77,39 @@ def follow():
 	global voiceFollow
 	global line1
 	global fig
-	line = qFollow.get()
-	list = string.split(line)
+	message = qFollow.get() #FOLLOW or FOLLOW_STOP
 	if not state == "following": #LILI just started following user
 		print "Following."
 		readyTT = False
-		mess = "follow "
-		if len(list) > 4: #"follow xCoord yCoord skeletonID timeStamp"
-			if int(list[3]) in skeletonPersonIDs.keys() and skeletonPersonIDs[int(list[3])] >= 0:	#handles if a name was given also, unrecognized means don't follow
-				mess = mess + str(skeletonPersonIDs[int(list[3])])
+		person = messages.NO_ID
+		if message.type == messages.FOLLOW and message.fields[2] != messages.NO_ID: #the followed user's skeleton is recognized
+			if message.fields[2] in skeletonPersonIDs.keys() and skeletonPersonIDs[message.fields[2]] >= 0:	#handles if a name was given also, unrecognized means don't follow
+				person = skeletonPersonIDs[message.fields[2]]
 			else:
 				readyTT = True #exits because should not follow
 				return
-		elif not voiceFollow and len(list) > 3: #"follow xCoord yCoord timeStamp" and follow was not started by voice command
+		elif not voiceFollow and message.type == messages.FOLLOW: #unrecognized user and follow was not started by voice command
 			readyTT = True #exits because should not follow
-			km.write("follow stop\n") #follow gesture came from unrecognized user and KM should stop sending information
+			km.send(messages.COMMAND, "follow stop") #follow gesture came from unrecognized user and KM should stop sending information
 			return
-		if len(list) > 3:
-			mess = mess + "\n"
-			sp.write(mess) #will speak a name if valid user gave gesture, will speak without a name if follow came from voice command
+		if message.type == messages.FOLLOW:
+			sp.send(messages.SAY, person, "follow") #will speak a name if valid user gave gesture, will speak without a name if follow came from voice command
 			state = "following" #user is now being followed
 	
-	if list[1] == "stop": #LILI received a stop command or has lost track of the user
+	if message.type == messages.FOLLOW_STOP: #LILI received a stop command or has lost track of the user
 		if state == "waiting": #state will be waiting if follow gesture received from unknown user and
 			return			 #handles feedback from KinectMonitor after sending a follow stop in this case
 		print "Stopping."
 		readyTT = False
 		r.setvel(0,0) #stop robot motion
 		r.vel = 0
-		mess = "stopFollow "
-		if len(list) > 3: #"follow stop idNum timeStamp"
-			try:
-				int(list[2])
-				mess = mess + list[2]
-			except ValueError:
-				mess = mess
-		mess = mess + "\n"
-		sp.write(mess)
+		sp.send(messages.SAY, messages.NO_ID, "stopFollow")
 		state = "waiting"
 		voiceFollow = False
 		lastMoveTime = time.time() #user no longer being followed
 		return
-	a = float(list[1]) #x coordinate of user relative to LILI
-	b = float(list[2]) #y coordinate of user relative to LILI
+	a = message.fields[0] #x coordinate of user relative to LILI
+	b = message.fields[1] #y coordinate of user relative to LILI
 
 	distF = 1.5 #distance behind person to follow
 	
@@ -147,36 +148,95 @@ def follow():
 def checkReady():
 	global readyTT
 	#reads the output from the TTS program
-	ready = sp.line.strip()
-	if ready=="ready": 
+	if sp.message.type == messages.READY: 
 		readyTT=True #TTS program is ready to speak again
+		while ttsWaiters and readyTT: #a waiter may make the TTS busy again
+			ttsWaiters.pop(0)()
 
-#adds command from KinectMonitor onto appropriate queue
-def KinectQueue():
-	line = km.line.strip()
-	print line
-	if line[:line.find(' ')] == "follow": #all information regarding following starts with the word "follow"
-		qFollow.put(line)
-	elif line[:line.find(' ')] == "face": #all information regarding faces start with the word "face"
-		qFace.put(line)
+#sends a phrase to the TTS, which is busy until it has been spoken
+def say(key, personID=messages.NO_ID):
+	global readyTT
+	readyTT = False
+	sp.send(messages.SAY, personID, key)
+
+#calls fct once the TTS is ready, right away if it is
+def whenTTSReady(fct):
+	if readyTT:
+		fct()
 	else:
+		ttsWaiters.append(fct)
+
+#handles messages until the TTS is ready or timeout seconds pass. returns whether it is ready
+def waitForTTS(timeout=None):
+	end = None if timeout is None else time.time() + timeout
+	while readyTT == False:
+		if end is None:
+			dispatcher.wait()
+		elif time.time() < end:
+			dispatcher.wait(end - time.time())
+		else:
+			break
+	return readyTT
+
+#called when no follow command came for followTimeout seconds
+def followLost():
+	global followTimer
+	followTimer = None
+	#stop following if the KinectMonitor stops sending values
+	if state == "following":
+		km.send(messages.COMMAND, 'follow stop')
+		followTimer = dispatcher.callLater(followTimeout, followLost)
+
+#adds command from KinectMonitor onto appropriate queue and responds to it
+def KinectQueue():
+	global followTimer
+	message = km.message
+	print message
+	if message.type in (messages.FOLLOW, messages.FOLLOW_STOP): #information regarding following
+		qFollow.put(message)
+		follow()
+		dispatcher.cancel(followTimer)
+		followTimer = dispatcher.callLater(followTimeout, followLost)
+	elif message.type in (messages.FACE_RECOGNIZED, messages.FACE_LOST, messages.FACE_UNRECOGNIZED): #information regarding faces
+		qFace.put(message)
+		faceResponse()
+	elif message.type == messages.GESTURE:
 	#Gestures received from the Kinect Monitor will be added to the queue
-		qGest.put(line)
+		qGest.put(message)
+		whenTTSReady(respondToGestures)
 
 #adds command from VoiceMonitor onto appropriate queue
 def VocalQueue():
 	global state
 	global voiceFollow
-	line = vm.line.strip()
+	if vm.message.type != messages.VOICE:
+		return
+	command = vm.message.fields[-1]
 	#follow information must be writeen to KinectMonitor so that it will start sending information about user location
-	if line == "follow":
+	if command == "follow":
 		voiceFollow = True #if follow started by voice command, LILI can follow unknown users. This allows for that functionality
-		km.write('follow\n')
-	if line == "stop":
-		km.write('follow stop\n')
-	else:
+		km.send(messages.COMMAND, 'follow')
+	if command == "stop":
+		km.send(messages.COMMAND, 'follow stop')
+	elif command in messages.GESTURES:
 	#Gestures received from the Voice Monitor will be added to the queue
-		qGest.put(line + ' ' + str(time.time()))
+		qGest.put(messages.Message(messages.GESTURE, vm.message.time, (messages.GESTURES.index(command), messages.VOICE_ID)))
+		whenTTSReady(respondToGestures)
+
+#called whenever VoiceMonitor has started up, including after it was restarted
+def voiceMonitorReady():
+	if voiceStarted:
+		vm.send(messages.COMMAND, "start")
+
+#responds to the queued gestures one at a time, waiting for the TTS between them
+def respondToGestures():
+	if not voiceStarted: #still starting up, the gestures are responded to at the end of start-up
+		return
+	while not qGest.empty() and not quit:
+		if readyTT == False:
+			whenTTSReady(respondToGestures)
+			return
+		GestureResponse()
 
 # Search for gesture
 #should have at least one item on qGest before calling this method
@@ -186,19 +246,11 @@ def GestureResponse():
 	if readyTT==False:
 		return
 	# when TTS is ready, pull the next gesture off of the queue
-	line = qGest.get() #line should be "command timeStamp" or "command personID timeStamp"
+	message = qGest.get() #a GESTURE message
 	
-	parts = line.split() #splits on whitespace by default
-	
-	gest = parts[0] #gesture command is the first word
-	timeStamp = 0.0
-	pID = -1
-	if len(parts) > 2: #line given was "command personID timeStamp"
-		pID = int(parts[1])
-		timeStamp = float(parts[2])
-	else:			 #line given was "command timeStamp"
-		timeStamp = float(parts[1])
-		pID = -3 #not a number that might be passed from KinectMonitor (those are either -2 or -1)
+	gest = messages.GESTURES[message.fields[0]]
+	timeStamp = message.time
+	pID = message.fields[1] #messages.VOICE_ID (-3) for voice commands, not a number that might be passed from KinectMonitor (those are either -2 or -1)
 
 	if gest == "quit":
 		Exit(pID)	
@@ -216,38 +268,31 @@ def GestureResponse():
 
 #should have at least one item on qFace queue before calling this method
 def faceResponse():
-	global readyTT
-
-	parts = qFace.get().split() #should be of the form "face [recognized|lost] skeletonID personID timeStamp"
-	if parts[1] == "recognized":
+	message = qFace.get() #FACE_RECOGNIZED or FACE_LOST with skeletonID and personID, or FACE_UNRECOGNIZED
+	if message.type == messages.FACE_RECOGNIZED:
 		#new recognized user
-		skeletonPersonIDs[int(parts[2])] = int(parts[3]) #add new user to dictionary
-		readyTT = False
-		sys.stderr.write("person is " + parts[3] + "\n")
-		if len(indivTime)<=int(parts[3]):
-			for x in range(len(indivTime),int(parts[3])+1):
-				indivTime.append(300.0)
-			sp.write( "hello " + parts[3] + "\n")
-		if indivTime[int(parts[3])]<0:
-			sp.write("hello " + parts[3] + "\n")
-		indivTime[int(parts[3])] = 300.0
+		skeleton, person = message.fields
+		skeletonPersonIDs[skeleton] = person #add new user to dictionary
+		sys.stderr.write("person is " + str(person) + "\n")
+		now = time.time()
+		if person not in greetAgainAt or greetAgainAt[person] < now:
+			say("hello", person)
+		greetAgainAt[person] = now + greetCooldown
 		
-	elif parts[1] == "lost":
+	elif message.type == messages.FACE_LOST:
 		#recognized user has left
-		
-		del skeletonPersonIDs[int(parts[2])] #remove user that has been lost
-		readyTT = False
-		#if parts[3]>=0:
-			#sp.write("bye " + parts[3] + "\n")
+		skeleton, person = message.fields
+		del skeletonPersonIDs[skeleton] #remove user that has been lost
+		#if person>=0:
+			#say("bye", person)
 		
 		
-	elif parts[1] == "unrecognized":
+	elif message.type == messages.FACE_UNRECOGNIZED:
 		#user has been marked as unkown and no more attempts will be made to recognize them
-		#readyTT = False
-		#sp.write("unrecognized\n")
+		#say("unrecognized")
 		z=1
 	else:
-		sys.stderr.write("invalid input " + parts[1] + "\n")
+		sys.stderr.write("invalid input " + str(message) + "\n")
 		
 		
 
@@ -262,18 +307,18 @@ def waveRight(personID):
 	readyTT = False
 	#check to see if person who gave wave is known
 	if personID == -3:
-		sp.write("right\n")
+		sp.send(messages.SAY, messages.NO_ID, "right")
 	elif personID >= 0:
-		sp.write("right " + str(personID) + "\n")
+		sp.send(messages.SAY, personID, "right")
 	else:
 		readyTT = True
 		return #gesture came from KinectMonitor and user is unrecognized should not execute command
 	print "Moving one meter to the right."
 	if not r.isbumped():
-		km.write("sleep\n")  #stop the kinect monitor actions while movement is happening
+		km.send(messages.COMMAND, "sleep")  #stop the kinect monitor actions while movement is happening
 		r.moveTo(r.x,r.y+1,r.theta) #is a blocking method call
 	r.setvel(0,0) #make sure robot has stopped
-	km.write("wake\n")   #start kinect monitor again
+	km.send(messages.COMMAND, "wake")   #start kinect monitor again
 	lastMoveTime = time.time() #update lastMoveTime
 	print "DONE\n"
 	'''
@@ -288,18 +333,18 @@ def waveLeft(personID):
 	readyTT = False
 	#check to see if person who gave wave is known
 	if personID == -3:
-		sp.write("left\n")
+		sp.send(messages.SAY, messages.NO_ID, "left")
 	elif personID >= 0:
-		sp.write("left " + str(personID) + "\n")
+		sp.send(messages.SAY, personID, "left")
 	else:
 		readyTT = True
 		return #gesture came from KinectMonitor and user is unrecognized should not execute command
 	print "Moving one meter to the left."
 	if not r.isbumped():
-		km.write("sleep\n")  #stop the kinect monitor actions while movement is happening
+		km.send(messages.COMMAND, "sleep")  #stop the kinect monitor actions while movement is happening
 		r.moveTo(r.x,r.y-1,r.theta) #is a blocking method call
 	r.setvel(0,0)
-	km.write("wake\n")   #start kinect monitor again
+	km.send(messages.COMMAND, "wake")   #start kinect monitor again
 	lastMoveTime = time.time() #update lastMoveTime
 	print "DONE\n"
 	'''
@@ -307,21 +352,17 @@ def waveLeft(personID):
 # Close connection
 #personID should be an integer representing the ID number for the person's face
 def Exit(personID):
-	global readyTT
 	global quit
 	print "Lily is going to sleep."
-	readyTT = False
 	#check to see if person who gave command is known
 	if personID == -3:
-		sp.write("bye\n")
+		say("bye")
 	elif personID >= 0:
-		sp.write("bye " + str(personID) + "\n")
+		say("bye", personID)
 	else:
-		readyTT = True
 		return #gesture came from KinectMonitor and user is unrecognized should not execute command
 	quit = True
 	r.delete()  
-	time.sleep(5) #to allow all subprocesses to close
 	
 
 #turns LILI 180 degrees to face the other direction
@@ -333,80 +374,69 @@ def turnAround():
 	print "Turn around received"
 	readyTT = False
 	if not r.isbumped():
-		km.write("sleep\n")
-		sp.write("turnAround\n")
+		km.send(messages.COMMAND, "sleep")
+		sp.send(messages.SAY, messages.NO_ID, "turnAround")
 		r.rotate(np.pi/1.1) #rotate 180 degrees
 	r.setvel(0,0)
-	km.write("wake\n")
+	km.send(messages.COMMAND, "wake")
 	lastMoveTime = time.time()
 	'''
 
+# every child reports through one dispatcher, so the main loop wakes up as
+# soon as any of them sends a message instead of polling each at a fixed rate
+dispatcher = IPC.Dispatcher()
+# restarts children that crash or hang
+children = supervisor.Supervisor(dispatcher)
+
 # How to search for a gesture
 #open communication to the kinect monitor
-km = IPC.process(False, 'KinectMonitor.py')
 	#when input from the kinect monitor is received,
 		# add the input to the queue
-km.setOnReadLine(KinectQueue)
+km = children.add('KinectMonitor.py', KinectQueue)
 
 # Lily's voice control
 	#open communication to phrasesToSay
-sp = IPC.process(False, 'phrasesToSay.py')
 	#when input is received from phrasesToSay,
 		#check if the TTS program is ready to receive input
-sp.setOnReadLine(checkReady)
+sp = children.add('phrasesToSay.py', checkReady)
 
 # Open Speech Recognition Control
-vm = IPC.process(False, 'VoiceMonitor.py')
-vm.setOnReadLine(VocalQueue)
+vm = children.add('VoiceMonitor.py', VocalQueue, voiceMonitorReady)
 
-# Initialize synchronization
-IPC.InitSync()
+children.start()
+
+#checks on the children every so often
+def superviseChildren():
+	children.check()
+	dispatcher.callLater(0.1, superviseChildren)
 
 # Open a serial connection to the create
 #jjn r = iRobotCreate.iRobotCreate(0, 5, "COM3")
-time.sleep(1)
 
 # Execute start-up commands
-# request input from the TTS
-sp.tryReadLine()
-readyTT = False
+# wait for every child to start
+children.wait_ready()
+superviseChildren()
 print "Lily is awake."
 # command TTS
-sp.write("hello\n")
+say("hello")
 
 #wait for the TTS to be ready
-while readyTT == False:
-	sp.tryReadLine()
-readyTT = False
+waitForTTS()
 print "Lily is ready!"
 #command TTS
-sp.write("query\n")
+say("query")
 
 #start VoiceMonitor listening
-vm.write("start\n")
-strike = 0;
-#Waiting state: search for gestures from the kinect monitor
+vm.send(messages.COMMAND, "start")
+voiceStarted = True
+respondToGestures() #gestures given during start-up
+#Waiting state: respond to the monitors as soon as they send something
+#everything happens in the callbacks and timers above
 while quit == False: # The user has not asked to quit.
-	vm.tryReadLine()  # receive input from the voice monitor
-	km.tryReadLine()  # receive input from the kinect monitor
-	sp.tryReadLine()  # receive input from the TTS
-	
-	for x in range(0,len(indivTime)):
-		indivTime[x] = indivTime[x]-0.2
-	if not qFollow.empty(): #if there is a command in the qFollow queue
-		follow()
-		strike = 0
-	else:
-		strike=strike+1
-		#stop following if the KinectMonitor stops sending values
-		if state == "following" and strike>2:
-			km.write('follow stop\n')
-			
-# if there are items on the queue, try to respond
-	if not qGest.empty():  
-		GestureResponse()
-	if not qFace.empty():
-		faceResponse()
-	IPC.Sync()
+	dispatcher.wait()
+#let the TTS finish saying goodbye, then stop every child
+waitForTTS(5)
+children.stop()
 print "deleting r"
 # jjn r.delete()
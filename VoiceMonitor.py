@@ -1,4 +1,5 @@
 import IPC
+import messages
 import sys
 import clr
 import time
@@ -13,7 +14,7 @@ import SpeechRecognitionApp as sra
 commands = ['Lily', 'rightWave', 'leftWave', 'follow', 'stop', 'turnAround', 'quit', 'storyMode'] #gesture commands
 recoged = ['Lily', 'Move right', 'Move left', 'Follow me', 'Stop', 'Turn around', 'Goodbye', 'Story mode'] #recognized phrases
 
-vm = IPC.process(True, 'VoiceMonitor.py')
+vm = IPC.process(True, 'VoiceMonitor.py', framed=True)
 
 started = False #changes once it gets start command from master controller
 Lily = False #user must say Lily before giving a command
@@ -26,17 +27,17 @@ engine = re.buildRecognizer() #create Speech Recognition Engine
 #for now, only used to receive start command
 def onLineRead():
     global started
-    message = vm.line.strip()
-    if message == "start":
+    message = vm.message
+    if message.type == messages.COMMAND and message.fields[-1] == "start":
         re.runRecognizer(engine) #start listening
         started = True  #changes to exit first while loop
 
 vm.setOnReadLine(onLineRead)
-IPC.InitSync()
-#keep checking if it should start listening
+vm.startHeartbeat() #tell master controller that it is still running
+vm.send(messages.READY) #tell master controller that it has started
+#wait for the start command
 while not started:
-    vm.tryReadLine()
-    IPC.Sync()
+    vm.readLine()
 
 while re.Listening == True: #while listening
    index = re.grabCommand()  #access recognized command
@@ -49,10 +50,12 @@ while re.Listening == True: #while listening
            if timeout < lilytime + 5:
                if index == 6: #index 6 is a quit command
                     re.stopListening(engine)
-               vm.write(str(commands[index])+'\n')
+               vm.send(messages.VOICE, commands[index])
                sys.stderr.write("Recognized Phrase "+str(recoged[index]) +"\n")
                if index == 7: #index 7 initiates interactive story 
                    interactive_story.runStory()
                Lily = False
            else:
                 Lily = False
+
+vm.send(messages.EXIT) #stopped listening on purpose, so the master controller doesn't restart it
@@ -0,0 +1,188 @@
+import pyaudio
+import sys
+
+from threading import Event, Lock, Thread
+from Queue import Queue, Empty
+
+class PlaybackHandle(object):
+    """Tracks one queued utterance
+    """
+
+    def __init__(self):
+        self._done = Event()
+        self._started = Event()
+        self._cancelled = False
+        self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def started(self):
+        return self._started.is_set()
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """Stop playing, or skip the utterance if it hasn't started yet
+        """
+        self._cancelled = True
+
+    def wait(self, timeout=None):
+        """Wait until the utterance has finished playing, re-raising any
+        error that stopped it from being played
+
+        Returns: {bool} Whether it finished within `timeout` seconds
+        """
+        # Event.wait(None) can't be interrupted with Ctrl-C in Python 2
+        while not self._done.wait(0.5 if timeout is None else timeout):
+            if timeout is not None:
+                return False
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return True
+
+    def _finish(self, exc_info=None):
+        self._exc_info = exc_info
+        self._done.set()
+
+class AudioOutput(object):
+    """A long-lived audio output. One PyAudio instance and output stream are
+    reused for every utterance, and queued utterances are written to the
+    stream back to back so there is no gap or pop between them
+    """
+
+    def __init__(self, frames_per_buffer=1024, on_start=None, on_idle=None):
+        """Constructor for AudioOutput
+
+        Parameters:
+        frames_per_buffer {int} The number of frames written at a time
+        on_start {callable} Called when playback starts after being idle
+        on_idle {callable} Called when the queue runs empty
+        """
+        self.frames_per_buffer = frames_per_buffer
+        self.on_start = on_start
+        self.on_idle = on_idle
+        self._queue = Queue()
+        self._lock = Lock()
+        self._pa = None
+        self._stream = None
+        self._params = None
+        self._thread = None
+        self._closed = False
+        self._playing = False
+
+    def play(self, source):
+        """Queue audio for playback and return immediately
+
+        Parameters:
+        source {tuple|Future} The (rate, sample width, channels) of the audio
+                              and a callable that is passed a number of bytes
+                              and returns the next PCM data, ending with a
+                              short read. May also be a Future resolving to
+                              that tuple, e.g. audio still being synthesized
+
+        Returns: {PlaybackHandle} A handle to wait on or cancel the playback
+        """
+        handle = PlaybackHandle()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('AudioOutput is closed')
+            self._queue.put((source, handle))
+            if self._thread is None:
+                self._thread = Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return handle
+
+    def playing(self):
+        """Returns: {bool} Whether audio is being played, from when playback
+                 starts until the queue runs empty
+        """
+        return self._playing
+
+    def close(self):
+        """Stop the playback thread and release the audio device
+        """
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        self._close_stream()
+        if self._pa is not None:
+            self._pa.terminate()
+            self._pa = None
+
+    def _run(self):
+        idle = True
+        while True:
+            try:
+                item = self._queue.get(timeout=0.05)
+            except Empty:
+                if not idle:
+                    idle = True
+                    self._playing = False
+                    if self.on_idle:
+                        self.on_idle()
+                continue
+            if item is None:
+                break
+            source, handle = item
+            if handle.cancelled():
+                handle._finish()
+                continue
+            try:
+                if hasattr(source, 'result'):
+                    source = source.result()
+                params, read = source
+                stream = self._get_stream(params)
+                if idle:
+                    idle = False
+                    self._playing = True
+                    if self.on_start:
+                        self.on_start()
+                handle._started.set()
+                self._write(stream, params, read, handle)
+            except Exception:
+                handle._finish(sys.exc_info())
+            else:
+                handle._finish()
+        self._playing = False
+        if not idle and self.on_idle:
+            self.on_idle()
+
+    def _write(self, stream, params, read, handle):
+        rate, width, channels = params
+        n_bytes = self.frames_per_buffer * width * channels
+        while not handle.cancelled():
+            data = read(n_bytes)
+            if data:
+                stream.write(data)
+            if len(data) < n_bytes:
+                break
+
+    def _get_stream(self, params):
+        """Returns an open stream for audio with format `params`, reusing the
+        current one unless the format changed
+        """
+        if self._stream is not None and params == self._params:
+            return self._stream
+        self._close_stream()
+        if self._pa is None:
+            self._pa = pyaudio.PyAudio()
+        rate, width, channels = params
+        self._stream = self._pa.open(format=self._pa.get_format_from_width(width),
+                                     channels=channels,
+                                     rate=rate,
+                                     output=True,
+                                     frames_per_buffer=self.frames_per_buffer)
+        self._params = params
+        return self._stream
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self._params = None
@@ -0,0 +1,207 @@
+"""Run conditions of story nodes. Conditions are small declarative
+predicates over the visited nodes and the context, so instead of calling a
+closure per condition every time, a ConditionIndex compiles the conditions
+of each node into two bitmasks: one over the visited nodes it requires and
+one over the context tests it requires. A node is runnable when both masks
+are covered by the bits currently set, and those bits only change when a
+node is visited or a context key the conditions look at changes.
+"""
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+
+class Condition(object):
+    """Base class of run conditions. `nodes` are the nodes the condition
+    looks at in the visited set and `keys` the context keys it looks at.
+    Subclasses implement __call__
+    """
+    __metaclass__ = ABCMeta
+
+    nodes = ()
+    keys = ()
+
+    @abstractmethod
+    def __call__(self, visited, context):
+        """Whether the condition holds for the `visited` nodes and `context`
+        """
+
+class Visited(Condition):
+    """True when every node in `nodes` has been visited
+    """
+
+    def __init__(self, *nodes):
+        self.nodes = tuple(str(n) for n in nodes)
+
+    def __call__(self, visited, context):
+        return all(n in visited for n in self.nodes)
+
+    def __repr__(self):
+        return 'Visited(%s)' % ', '.join(map(repr, self.nodes))
+
+class HasKey(Condition):
+    """True when `key` is in the context
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.keys = (key,)
+
+    def __call__(self, visited, context):
+        return self.key in context
+
+    def __repr__(self):
+        return 'HasKey(%r)' % self.key
+
+class Equals(Condition):
+    """True when `key` is in the context and its value is `value`
+    """
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.keys = (key,)
+
+    def __call__(self, visited, context):
+        return self.key in context and context[self.key] == self.value
+
+    def __repr__(self):
+        return 'Equals(%r, %r)' % (self.key, self.value)
+
+class ConditionIndex(object):
+    """The compiled run conditions of every node of a story. Each node a
+    Visited condition refers to and each context test gets a bit. Conditions
+    that aren't a Condition, e.g. a plain callable, are called every time.
+
+    The nodes whose compiled conditions don't hold are kept in a set, and a
+    dependency index from visited nodes and context keys to the nodes whose
+    conditions look at them means a visit or a context update only rechecks
+    the nodes it affects
+    """
+
+    def __init__(self):
+        self.visited = set() # the story's visited nodes, see add and reset
+        self.context = {} # the story's context, see update
+        self.visited_bits = 0 # bits of the visited nodes
+        self.fact_bits = 0 # bits of the context tests that currently hold
+        self._node_bits = {} # node -> bit
+        self._facts = [] # context test of each bit
+        self._key_facts = defaultdict(list) # context key -> indices of tests
+        self._node_facts = defaultdict(list) # node -> indices of tests
+        self._masks = {} # node -> (visited mask, fact mask)
+        self._opaque = defaultdict(list) # node -> callables
+        self._node_deps = defaultdict(set) # visited node -> dependent nodes
+        self._key_deps = defaultdict(set) # context key -> dependent nodes
+        self._blocked = set() # nodes whose compiled conditions don't hold
+
+    def add(self, node, condition, visited=None, context=None):
+        """Add `condition` to the run conditions of `node`, evaluating it
+        against the current `visited` nodes and `context`. The index keeps
+        both, without copying them, to evaluate conditions against later
+        """
+        if visited is not None:
+            self.visited = visited
+        if context is not None:
+            self.context = context
+        if not isinstance(condition, Condition):
+            self._opaque[node].append(condition)
+            return
+        visited_mask, fact_mask = self._masks.get(node, (0, 0))
+        for n in condition.nodes:
+            if n not in self._node_bits:
+                bit = 1 << len(self._node_bits)
+                self._node_bits[n] = bit
+                if n in self.visited:
+                    self.visited_bits |= bit
+            visited_mask |= self._node_bits[n]
+            self._node_deps[n].add(node)
+        if condition.keys:
+            i = len(self._facts)
+            bit = 1 << i
+            self._facts.append(condition)
+            for key in condition.keys:
+                self._key_facts[key].append(i)
+                self._key_deps[key].add(node)
+            for n in condition.nodes: # a test may look at both
+                self._node_facts[n].append(i)
+            if condition(self.visited, self.context):
+                self.fact_bits |= bit
+            fact_mask |= bit
+        self._masks[node] = (visited_mask, fact_mask)
+        self._recheck([node])
+
+    def visit(self, node):
+        """Mark `node` as visited
+        """
+        self.visited.add(node)
+        bit = self._node_bits.get(node, 0)
+        if bit and not self.visited_bits & bit:
+            self.visited_bits |= bit
+            self._recheck(self._node_deps[node])
+        if node in self._node_facts:
+            self._evaluate(self._node_facts[node], self._node_deps[node])
+
+    def update(self, context, keys):
+        """Re-evaluate the context tests that look at the context keys `keys`,
+        which changed in `context`
+        """
+        self.context = context
+        indices = []
+        affected = set()
+        for key in keys:
+            indices.extend(self._key_facts.get(key, ()))
+            affected.update(self._key_deps.get(key, ()))
+        self._evaluate(indices, affected)
+
+    def reset(self, visited, context):
+        """Re-evaluate everything against `visited` and `context`
+        """
+        self.visited = visited
+        self.visited_bits = 0
+        for n in visited:
+            self.visited_bits |= self._node_bits.get(n, 0)
+        self.update(context, list(self._key_facts))
+        self._recheck(list(self._masks))
+
+    def remove(self, node):
+        """Drop the run conditions of `node`, e.g. when it is removed from the
+        story. Conditions of other nodes that require visiting it stay
+        """
+        self._masks.pop(node, None)
+        self._opaque.pop(node, None)
+        self._blocked.discard(node)
+        for deps in self._node_deps.itervalues():
+            deps.discard(node)
+        for deps in self._key_deps.itervalues():
+            deps.discard(node)
+
+    def is_runnable(self, node):
+        """Whether the run conditions of `node` hold
+        """
+        if node in self._blocked:
+            return False
+        for check in self._opaque.get(node, ()):
+            if not check():
+                return False
+        return True
+
+    def _evaluate(self, indices, affected):
+        """Re-evaluate the tests at `indices` and recheck the nodes in
+        `affected` if any of them changed
+        """
+        fact_bits = self.fact_bits
+        for i in indices:
+            if self._facts[i](self.visited, self.context):
+                fact_bits |= 1 << i
+            else:
+                fact_bits &= ~(1 << i)
+        if fact_bits != self.fact_bits:
+            self.fact_bits = fact_bits
+            self._recheck(affected)
+
+    def _recheck(self, nodes):
+        for node in nodes:
+            visited_mask, fact_mask = self._masks[node]
+            if visited_mask & ~self.visited_bits or \
+                    fact_mask & ~self.fact_bits:
+                self._blocked.add(node)
+            else:
+                self._blocked.discard(node)
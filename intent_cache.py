@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+_PUNCTUATION = re.compile(r"[^\w\s']", re.UNICODE)
+_WHITESPACE = re.compile(r'\s+', re.UNICODE)
+
+def normalize(s):
+    """Normalize an utterance `s` so that trivially different transcriptions
+    ("Box office!", "box  office") share a cache entry
+    """
+    s = _PUNCTUATION.sub(' ', s.lower())
+    return _WHITESPACE.sub(' ', s).strip()
+
+class IntentCache(object):
+    """A size-bounded LRU cache of parse responses keyed on
+    (workspace_id, normalized utterance). Entries older than `ttl` seconds are
+    treated as misses. The cache can be persisted to a JSON file so that it
+    survives restarts.
+    """
+
+    def __init__(self, max_size=1024, ttl=7*24*60*60, path=None):
+        """Constructor for IntentCache
+
+        Parameters:
+        max_size {int} The maximum number of entries kept before the least
+                       recently used entry is evicted
+        ttl {float} The number of seconds an entry stays valid. None means
+                    entries never expire
+        path {str} The file the cache is loaded from and saved to. None means
+                   the cache is kept in memory only
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict() # key -> (timestamp, response)
+        self._lock = Lock()
+        self._save_lock = Lock() # one save at a time, see save
+        self._dirty = False
+        self.unsaved = 0 # entries put since the last save
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._key(*key) in self._entries
+
+    @property
+    def stats(self):
+        """A dict of the hit, miss, eviction and expiration counters
+        """
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+    def get(self, workspace_id, s):
+        """Get the cached response for utterance `s` in workspace
+        `workspace_id`, or None if there is no valid entry
+        """
+        key = self._key(workspace_id, s)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            timestamp, response = entry
+            if self.ttl is not None and time.time() - timestamp > self.ttl:
+                self.expirations += 1
+                self.misses += 1
+                self._dirty = True
+                return None
+            self._entries[key] = entry # move to the most recently used end
+            self.hits += 1
+            return response
+
+    def put(self, workspace_id, s, response):
+        """Cache `response` for utterance `s` in workspace `workspace_id`
+        """
+        key = self._key(workspace_id, s)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), response)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+            self.unsaved += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def load(self, path=None):
+        """Load entries from the JSON file at `path`, defaulting to self.path.
+        Expired entries are dropped
+        """
+        path = path or self.path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for workspace_id, s, timestamp, response in data.get('entries', []):
+                if self.ttl is not None and now - timestamp > self.ttl:
+                    continue
+                self._entries[self._key(workspace_id, s)] = (timestamp, response)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def save(self, path=None):
+        """Write the entries to the JSON file at `path`, defaulting to
+        self.path. Does nothing if the cache hasn't changed since it was last
+        loaded or saved
+        """
+        path = path or self.path
+        if not path or not self._dirty:
+            return
+        with self._save_lock:
+            with self._lock:
+                entries = [[k[0], k[1], t, r]
+                           for k, (t, r) in self._entries.iteritems()]
+                self._dirty = False
+                self.unsaved = 0
+            # write to a temporary file first so a crash never leaves a
+            # truncated cache behind
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'entries': entries}, f)
+            if os.path.exists(path):
+                os.remove(path) # os.rename doesn't overwrite on Windows
+            os.rename(tmp_path, path)
+
+    def _key(self, workspace_id, s):
+        return (workspace_id, normalize(s))
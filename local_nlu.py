@@ -0,0 +1,258 @@
+"""An offline stand-in for the Watson Conversation service. Each workspace is
+described by an example file in `nlu/` listing sample utterances for every
+intent and the synonyms of every entity value. Utterances are classified by
+TF-IDF cosine similarity against the examples, and the response has the same
+shape as the one returned by ConversationV1.message so get_intent and
+get_entities work unchanged.
+"""
+import json
+import math
+import os
+import re
+
+from collections import defaultdict
+from intent_cache import normalize
+
+NLU_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nlu')
+
+_TOKEN = re.compile(r"[\w']+|@\w+", re.UNICODE)
+
+class NLUError(Exception):
+    pass
+
+def tokenize(s):
+    return _TOKEN.findall(s)
+
+def example_tokens(example):
+    """Tokenize and normalize an example, keeping its @entity_type
+    references, which normalize would strip the @ from
+    """
+    tokens = []
+    for token in tokenize(example):
+        if token.startswith('@'):
+            tokens.append(token)
+        else:
+            tokens.extend(tokenize(normalize(token)))
+    return tokens
+
+class Workspace(object):
+    """The intents and entities of a single workspace, trained from an example
+    file
+    """
+
+    def __init__(self, workspace_id, intents, entities, name=''):
+        """Constructor for Workspace
+
+        Parameters:
+        workspace_id {str} The workspace ID the examples stand in for
+        intents {dict} Maps intent names to lists of example utterances.
+                       Examples may refer to an entity type with @entity_type
+        entities {dict} Maps entity types to dicts mapping each value to a list
+                        of synonyms
+        name {str} A human readable name for the workspace
+        """
+        self.workspace_id = workspace_id
+        self.name = name
+        self.intents = intents
+        self.entities = entities
+        self._synonyms = [] # (synonym tokens, entity type, value)
+        self._idf = {}
+        self._examples = [] # (intent, weighted vector, norm)
+        self._train()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        try:
+            return cls(data['workspace_id'], data['intents'],
+                       data.get('entities', {}), data.get('name', ''))
+        except KeyError as e:
+            raise NLUError('%s is missing %s' % (path, e))
+
+    def message(self, s, intents=None):
+        """Classify utterance `s` and return a response dict with `intents`
+        sorted by confidence and the `entities` found in `s`. If `intents` is
+        given, only those intents are considered
+        """
+        tokens = tokenize(normalize(s))
+        entities, tokens = self._extract_entities(tokens)
+        vec, norm = self._vectorize(tokens)
+
+        if intents is None:
+            intents = self.intents
+        scores = dict((intent, 0.) for intent in intents
+                      if intent in self.intents)
+        if norm:
+            for intent, ex_vec, ex_norm in self._examples:
+                if intent not in scores:
+                    continue
+                dot = sum(w * ex_vec.get(t, 0.) for t, w in vec.iteritems())
+                score = dot / (norm * ex_norm)
+                if score > scores[intent]:
+                    scores[intent] = score
+        # cosine similarities of paraphrases sit well below Watson's
+        # confidences, so the square root is reported to keep get_intent's
+        # default threshold meaningful
+        intents = [{'intent': intent, 'confidence': math.sqrt(score)}
+                   for intent, score in sorted(scores.iteritems(),
+                                               key=lambda i: -i[1])]
+
+        return {'input': {'text': s},
+                'intents': intents,
+                'entities': entities}
+
+    def coverage(self, s):
+        """Returns the fraction of the words of utterance `s` the workspace
+        knows from its examples, counting each entity synonym as one word.
+        Unknown words are ignored by message, so an off-topic utterance that
+        happens to name an entity can still score a high confidence
+        """
+        _, tokens = self._extract_entities(tokenize(normalize(s)))
+        if not tokens:
+            return 0.
+        return sum(1. for t in tokens if t in self._idf) / len(tokens)
+
+    def phrases(self, intents):
+        """Returns the phrases a user is likely to say for `intents`: their
+        examples and the synonyms of the entities the examples refer to.
+        Examples that refer to an entity are left out since the words around
+        the entity are better spotted on their own
+        """
+        phrases = set()
+        entity_types = set()
+        for intent in intents:
+            for example in self.intents.get(intent, []):
+                refs = [t[1:] for t in example_tokens(example)
+                        if t.startswith('@')]
+                if refs:
+                    entity_types.update(refs)
+                else:
+                    phrases.add(normalize(example))
+        for syn_tokens, entity_type, _ in self._synonyms:
+            if entity_type in entity_types:
+                phrases.add(' '.join(syn_tokens))
+        return sorted(phrases)
+
+    def _train(self):
+        for entity_type, values in self.entities.iteritems():
+            for value, synonyms in values.iteritems():
+                for synonym in set([value] + list(synonyms)):
+                    syn_tokens = tuple(tokenize(normalize(synonym)))
+                    self._synonyms.append((syn_tokens, entity_type, value))
+        # match longer synonyms first so "inside out" beats "out"
+        self._synonyms.sort(key=lambda syn: -len(syn[0]))
+
+        docs = []
+        for intent, examples in self.intents.iteritems():
+            for example in examples:
+                _, tokens = self._extract_entities(example_tokens(example))
+                docs.append((intent, tokens))
+        if not docs:
+            raise NLUError('Workspace %s has no examples' % self.workspace_id)
+
+        doc_freq = defaultdict(int)
+        for _, tokens in docs:
+            for token in set(tokens):
+                doc_freq[token] += 1
+        n_docs = float(len(docs))
+        self._idf = dict((t, math.log(1. + n_docs / df))
+                         for t, df in doc_freq.iteritems())
+
+        for intent, tokens in docs:
+            vec, norm = self._vectorize(tokens)
+            if norm:
+                self._examples.append((intent, vec, norm))
+
+    def _vectorize(self, tokens):
+        """Returns the IDF weighted vector of `tokens` and its norm. Term
+        counts are ignored since a repeated entity ("@snacks and @snacks")
+        says nothing more about the intent. Tokens never seen in training are
+        ignored
+        """
+        vec = {}
+        for token in tokens:
+            if token in self._idf:
+                vec[token] = self._idf[token]
+        norm = math.sqrt(sum(w * w for w in vec.itervalues()))
+        return vec, norm
+
+    def _extract_entities(self, tokens):
+        """Find entity synonyms in `tokens`. Returns the entities found and
+        the tokens with each synonym replaced by @entity_type
+        """
+        entities = []
+        out = []
+        i = 0
+        while i < len(tokens):
+            for syn_tokens, entity_type, value in self._synonyms:
+                n = len(syn_tokens)
+                if n and tuple(tokens[i:i+n]) == syn_tokens:
+                    entities.append({'entity': entity_type, 'value': value})
+                    out.append('@' + entity_type)
+                    i += n
+                    break
+            else:
+                out.append(tokens[i])
+                i += 1
+        return entities, out
+
+class LocalNLU(object):
+    """A collection of workspaces loaded from the example files in a directory
+    """
+
+    def __init__(self, path=NLU_DIR):
+        self.path = path
+        self._workspaces = None
+
+    @property
+    def workspaces(self):
+        # loaded lazily so the files are only read if the backend is used
+        if self._workspaces is None:
+            self._workspaces = {}
+            for fname in sorted(os.listdir(self.path)):
+                if fname.endswith('.json'):
+                    ws = Workspace.from_file(os.path.join(self.path, fname))
+                    self._workspaces[ws.workspace_id] = ws
+        return self._workspaces
+
+    def message(self, workspace_id, message_input, intents=None):
+        """Mirrors ConversationV1.message. `intents` restricts the intents
+        considered, see Workspace.message
+        """
+        return self.workspace(workspace_id).message(message_input['text'],
+                                                    intents)
+
+    def workspace(self, workspace_id):
+        try:
+            return self.workspaces[workspace_id]
+        except KeyError:
+            raise NLUError('No examples for workspace %s' % workspace_id)
+
+nlu = LocalNLU()
+
+def parse(s, workspace_id, intents=None):
+    """Parse a string `s` using the workspace with ID `workspace_id`,
+    considering only `intents` if given
+    """
+    return nlu.message(workspace_id=workspace_id, message_input={'text': s},
+                       intents=intents)
+
+def coverage(s, workspace_id):
+    """Returns the fraction of the words of `s` the workspace with ID
+    `workspace_id` knows, see Workspace.coverage
+    """
+    return nlu.workspace(workspace_id).coverage(s)
+
+def phrases(workspace_id, intents):
+    """Returns the phrases likely to be said for `intents` of the workspace
+    with ID `workspace_id`, see Workspace.phrases
+    """
+    return nlu.workspace(workspace_id).phrases(intents)
+
+def main():
+    w_id = "569456a8-facf-431d-a963-493d905b77ea" # Movie workspace
+    print(json.dumps(parse("I want a ticket for Minions", w_id), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,10 @@
 from __future__ import print_function
 
 import inspect
-import cPickle as pickle
 import matplotlib.pyplot as plt
 import io
 import networkx as nx
+import story_format
 
 from story import Story, StoryError
 from functools import partial
@@ -323,32 +323,25 @@ class EditScreen(Screen):
                 filename.append('story')
             filename = '.'.join(filename)
             print(filename)
-            with open(filename, 'w') as f:
-                pickle.dump(self.story, f)
+            story_format.save(self.story, filename)
         else:
             self.show_file_browser('save as')
 
     def load_story(self, path):
         # TODO: check whether current file is saved
-        with open(path, 'r') as f:
-            try:
-                obj = pickle.load(f)
-            except IOError as e:
-                print(str(e))
-                return
-
-            if isinstance(obj, Story):
-                self.story = obj
-            else:
-                # TODO: display helpful message
-                return
-
-            for node in self.story:
-                b = Button(text=node, size_hint_y=None, height=dp(30)) 
-                b.bind(on_release=self.show_info_callback)
-                self.d.add_widget(b)
-
-            self.refresh_graph()
+        try:
+            self.story = story_format.open_story(path)
+        except (IOError, story_format.StoryFormatError) as e:
+            # TODO: display helpful message
+            print(str(e))
+            return
+
+        for node in self.story:
+            b = Button(text=node, size_hint_y=None, height=dp(30)) 
+            b.bind(on_release=self.show_info_callback)
+            self.d.add_widget(b)
+
+        self.refresh_graph()
 
     def check_current_file(self):
         board = self.ids['board']
@@ -0,0 +1,135 @@
+"""Binary messages between LilyMasterControl and its child processes. Every
+message is a frame with a fixed header followed by a payload laid out by its
+type, so nothing is formatted into text or split and parsed again:
+
+    magic 'LM' | type uint8 | payload length uint16 | timestamp double | payload
+
+Numbers in the payload are packed with struct, little-endian. Types with a
+text field carry it as the rest of the payload. Frames are decoded in place
+with struct.unpack_from, so the buffer is never sliced into field strings.
+A reader that finds anything but the magic where a frame should start, e.g.
+a stray print to stdout, skips ahead to the next frame.
+"""
+import struct
+import time
+
+from collections import namedtuple
+
+MAGIC = b'LM'
+HEADER = struct.Struct('<2sBHd')
+
+NO_ID = -1 # skeleton or person that isn't known
+VOICE_ID = -3 # person of a gesture that was a voice command
+
+# gestures by index, see GESTURE
+GESTURES = ('rightWave', 'leftWave', 'turnAround', 'quit')
+
+# KinectMonitor -> LilyMasterControl
+FOLLOW = 1 # x, y, skeleton. Where the followed user is, in meters
+FOLLOW_STOP = 2 # the followed user was lost or asked to stop
+GESTURE = 3 # gesture, person
+FACE_RECOGNIZED = 4 # skeleton, person
+FACE_LOST = 5 # skeleton, person
+FACE_UNRECOGNIZED = 6
+# VoiceMonitor -> LilyMasterControl
+VOICE = 7 # command
+# phrasesToSay -> LilyMasterControl
+READY = 8 # done speaking. Every child also sends it once it has started up
+NOT_YET = 9 # started speaking
+# LilyMasterControl -> children
+COMMAND = 10 # command, e.g. "start", "follow", "follow stop", "sleep"
+SAY = 11 # person, phrase key. The person's name is said if person >= 0
+# children -> LilyMasterControl
+HEARTBEAT = 12 # still alive, see supervisor
+EXIT = 13 # exiting on purpose, so it isn't restarted
+
+# type -> (struct of the fixed fields, whether a text field follows)
+SCHEMAS = {
+    FOLLOW: (struct.Struct('<ddi'), False),
+    FOLLOW_STOP: (struct.Struct('<'), False),
+    GESTURE: (struct.Struct('<Bi'), False),
+    FACE_RECOGNIZED: (struct.Struct('<ii'), False),
+    FACE_LOST: (struct.Struct('<ii'), False),
+    FACE_UNRECOGNIZED: (struct.Struct('<'), False),
+    VOICE: (struct.Struct('<'), True),
+    READY: (struct.Struct('<'), False),
+    NOT_YET: (struct.Struct('<'), False),
+    COMMAND: (struct.Struct('<'), True),
+    SAY: (struct.Struct('<i'), True),
+    HEARTBEAT: (struct.Struct('<'), False),
+    EXIT: (struct.Struct('<'), False),
+}
+
+Message = namedtuple('Message', 'type time fields')
+
+class MessageError(Exception):
+    pass
+
+def pack(type, *fields, **kwargs):
+    """Returns the frame of a message
+
+    Parameters:
+    type {int} The message type
+    fields The fields of the type, the text field last
+    t {float} Optional keyword. The timestamp. Defaults to now
+
+    Returns: {str} The frame
+    """
+    try:
+        fixed, has_text = SCHEMAS[type]
+    except KeyError:
+        raise MessageError('Unknown message type %s' % type)
+    if has_text:
+        text = fields[-1]
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        payload = fixed.pack(*fields[:-1]) + text
+    else:
+        payload = fixed.pack(*fields)
+    t = kwargs.get('t')
+    return HEADER.pack(MAGIC, type, len(payload),
+                       time.time() if t is None else t) + payload
+
+def unpack(buf, offset=0):
+    """Decode the frame at `offset` in `buf`, which must hold all of it
+
+    Returns: {tuple} The Message and the offset after the frame
+    """
+    magic, type, length, t = HEADER.unpack_from(buf, offset)
+    if magic != MAGIC:
+        raise MessageError('No frame at offset %d' % offset)
+    return _decode(type, t, buf, offset + HEADER.size, length), \
+        offset + HEADER.size + length
+
+def read_message(f):
+    """Read the next message from the file object `f`, skipping anything
+    before it that isn't a frame
+
+    Returns: {Message} The message, or None at the end of the file
+    """
+    header = f.read(HEADER.size)
+    while True:
+        if len(header) < HEADER.size:
+            return None
+        if header.startswith(MAGIC):
+            break
+        i = header.find(MAGIC[0], 1)
+        if i == -1:
+            i = len(header)
+        header = header[i:] + f.read(i)
+    _, type, length, t = HEADER.unpack(header)
+    buf = f.read(length)
+    if len(buf) < length:
+        return None
+    return _decode(type, t, buf, 0, length)
+
+def _decode(type, t, buf, offset, length):
+    try:
+        fixed, has_text = SCHEMAS[type]
+    except KeyError:
+        raise MessageError('Unknown message type %s' % type)
+    fields = fixed.unpack_from(buf, offset)
+    if has_text:
+        start = offset + fixed.size
+        fields += (buf[start:offset + length],)
+    return Message(type, t, fields)
@@ -1,10 +1,12 @@
 from story import Story 
-from speech_recog import get_input
-from text_to_speech import speak
+from story_journal import StoryJournal
+from speech_recog import capture, get_input, stream_input
+from text_to_speech import output, speak, speak_async, speak_template_async
 from threading import Thread
 from avatar_player import run_avatar
 
 WKSPACE_ID = "569456a8-facf-431d-a963-493d905b77ea" 
+JOURNAL_PATH = 'movie_story.journal'
 
 def set_actions(s):
     # movie greeting
@@ -54,10 +56,15 @@ def get_name():
     speak('Could you spell your name for me?')
     return get_input()
 
-def movie_story_factory():
-    """Create and return the movie story
+def movie_story_factory(name=None):
+    """Create and return the movie story. The visitor is asked for their name
+    unless `name` is given
     """
-    s = Story(input_fct=get_input, output_fct=speak, workspace_id=WKSPACE_ID)
+    # barge-in must not be set off by the robot's own voice
+    capture.playing = output.playing
+    s = Story(input_fct=get_input, output_fct=speak_async, workspace_id=WKSPACE_ID,
+              stream_fct=stream_input, template_fct=speak_template_async,
+              barge_in=True, use_grammar=True)
     s.add_node('movie_greeting')
     s.add_node('box_office')
     s.add_node('concessions')
@@ -76,7 +83,9 @@ def movie_story_factory():
     s.add_edges_from(dir_edges)
     s.add_undirected_edges_from(undir_edges)
 
-    context = {'name': get_name(), 
+    if name is None:
+        name = get_name()
+    context = {'name': name, 
                'movie_names': ["inside out", "tomorrowland", "minions", "home"],
                'movie_choice': None,
                'menu': ["soda", "popcorn", "candy"],
@@ -88,12 +97,20 @@ def movie_story_factory():
     return s
 
 def main():
-    s = movie_story_factory()
+    # pick up where the last visitor left off if the story was interrupted
+    journal = StoryJournal(JOURNAL_PATH)
+    state = journal.recover()
+    if state:
+        s = movie_story_factory(name=state['context'].get('name', ''))
+    else:
+        s = movie_story_factory()
+    journal.attach(s, state)
     thread = Thread(target=run_avatar)
     thread.daemon = True
     thread.start()
     while not s.is_finished:
         s()
+    journal.close()
 
 if __name__ == '__main__':
     main()
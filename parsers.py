@@ -1,15 +1,31 @@
+import atexit
 import json
+import os
+import local_nlu
 
+from difflib import SequenceMatcher
 from watson_developer_cloud import ConversationV1
-from timeout import timeout_decorate, TimeoutError
-
-ConversationV1.message = timeout_decorate(ConversationV1.message, seconds=5)
+from timeout import pool, retry, TimeoutError
+from intent_cache import IntentCache, normalize
 
 convo = ConversationV1(version='2016-07-11',
                        url="https://gateway.watsonplatform.net/conversation/api",
                        username='a183c3b3-538c-41ae-912e-6a4694261279',
                        password='XgEzF4MENrKf')
 
+# 'watson' uses the hosted Conversation service, 'local' the offline engine in
+# local_nlu trained from the example files in nlu/
+BACKEND = os.environ.get('LILY_NLU_BACKEND', 'watson')
+
+# responses are cached locally so repeated utterances skip the round-trip.
+# The file sits next to this module whatever the working directory, and is
+# written in the background every SAVE_EVERY new responses and at exit
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'intent_cache.json')
+SAVE_EVERY = 16
+cache = IntentCache(max_size=2048, path=CACHE_PATH)
+atexit.register(cache.save)
+
 class ParseError(Exception):
     pass 
 
@@ -30,31 +46,110 @@ def get_entities(response, entity_type=''):
     else:
         return [entity['value'].lower() for entity in response['entities']]
 
-def parse(s, workspace_id):
+def parse(s, workspace_id, grammar=None):
     """Parse a string `s`
 
     Parameters:
     s {str} The string to parse
     workspace_id {str} The ID corresponding to the workspace created for 
                        any given storyline 
+    grammar {dict} Optional. The `intents` that are valid and the `phrases`
+                   likely to be said, like Story.grammar returns. `s` is
+                   first matched locally against just those intents, and
+                   only parsed as usual if none of them fits
 
     Returns: {dict} The response if the parse was successful
     """
-    response = None
-    for i in range(3): 
+    if grammar:
+        response = parse_with_grammar(s, workspace_id, grammar)
+        if response:
+            return response
+
+    if BACKEND == 'local':
         try:
-            response = convo.message(workspace_id=workspace_id, message_input={'text': s})
-        except TimeoutError:
-            print('Timeout %d occured' % i)
-        else:
-            break
+            return local_nlu.parse(s, workspace_id)
+        except local_nlu.NLUError as e:
+            raise ParseError(str(e))
+
+    response = cache.get(workspace_id, s)
+    if response:
+        return response
+
+    def on_timeout(i):
+        print('Timeout %d occured' % i)
+
+    try:
+        response = retry(convo.message,
+                         kwargs={'workspace_id': workspace_id,
+                                 'message_input': {'text': s}},
+                         attempts=3, seconds=5, on_timeout=on_timeout)
+    except TimeoutError:
+        pass
     
     # print(json.dumps(response, indent=2))
     if response:
+        cache.put(workspace_id, s, response)
+        if cache.unsaved >= SAVE_EVERY:
+            pool.submit(cache.save)
         return response
     else:
         raise ParseError('No response received')
 
+def parse_with_grammar(s, workspace_id, grammar, t=0.8, min_coverage=0.6):
+    """Classify `s` locally against only the intents in `grammar`, after
+    snapping misrecognized words to the phrases in `grammar`
+
+    Returns: {dict} The response, or None if no intent in `grammar` has a
+             confidence above `t`, fewer than `min_coverage` of the words
+             are known to the workspace, e.g. an off-topic answer that
+             mentions an entity, or the workspace has no local examples
+    """
+    if not grammar.get('intents'):
+        return None
+    text = snap(s, grammar.get('phrases', []))
+    try:
+        if local_nlu.coverage(text, workspace_id) < min_coverage:
+            return None
+        response = local_nlu.parse(text, workspace_id, grammar['intents'])
+    except local_nlu.NLUError:
+        return None
+    if response['intents'] and get_intent(response, t):
+        return response
+    return None
+
+def grammar_phrases(workspace_id, intents):
+    """Returns the phrases likely to be said for `intents`, taken from the
+    local examples of the workspace. Empty if there are no examples
+    """
+    try:
+        return local_nlu.phrases(workspace_id, intents)
+    except local_nlu.NLUError:
+        return []
+
+def snap(s, phrases, cutoff=0.8):
+    """Replace the words of `s` that closely resemble one of `phrases` with
+    that phrase, e.g. "a ticket for minion" becomes "a ticket for minions"
+    """
+    tokens = normalize(s).split()
+    targets = sorted(set(normalize(p) for p in phrases if p),
+                     key=lambda p: -len(p.split()))
+    out = []
+    i = 0
+    while i < len(tokens):
+        for target in targets:
+            n = len(target.split())
+            if i + n > len(tokens):
+                continue
+            window = ' '.join(tokens[i:i+n])
+            if SequenceMatcher(None, window, target).ratio() >= cutoff:
+                out.append(target)
+                i += n
+                break
+        else:
+            out.append(tokens[i])
+            i += 1
+    return ' '.join(out)
+
 def main():
     w_id = "569456a8-facf-431d-a963-493d905b77ea" # Movie workspace
     parse("I want to buy a ticket", w_id)
@@ -2,6 +2,7 @@ import time
 import sys
 import ctypes
 import IPC
+import messages
 lib=ctypes.CDLL('FakeInputWin')
 
 #FakeInputWin simulates input into the BaldiSync window
@@ -13,7 +14,7 @@ def speak(key):
     if(key in phrases):
         lib.typeInBaldi(phrases[key]) #pass the phrase for BaldiSync to say
         time.sleep(delay[key]) #sleeps so that a new phrase isn't started before the other is finished
-        p.write('ready\n')  #tell master controller that it is ready for another phrase
+        p.send(messages.READY)  #tell master controller that it is ready for another phrase
               
 #should be a valid key code, speaks the name after the phrase   
 def speakName(key, name):
@@ -21,7 +22,7 @@ def speakName(key, name):
     if key in phrases:
         lib.typeInBaldi(phrases[key] + " " + name)
         time.sleep(.3 + delay[key])
-        p.write('ready\n')
+        p.send(messages.READY)
 
 #method for adding a new key-phrase pair witha given delay
 def addPhrase(key, phrase, d):
@@ -33,18 +34,20 @@ def addPerson(name):
     names.append(name)
 
 def onLineRead():
-    message = p.line.strip().split()
-    if message[0] in phrases and message[0] in delay:
-        if len(message) > 1:
-            if int(message[1]) < len(names):  #means a valid person ID was passed as well as a key
-                p.write('not yet\n')  #tell master controller that a phrase is still being spoken
-                speakName(message[0], names[int(message[1])])
+    if p.message.type != messages.SAY:
+        return
+    person, key = p.message.fields
+    if key in phrases and key in delay:
+        if person >= 0:
+            if person < len(names):  #means a valid person ID was passed as well as a key
+                p.send(messages.NOT_YET)  #tell master controller that a phrase is still being spoken
+                speakName(key, names[person])
             else: #person ID was invalid for phrasesToSay
-                p.write('not yet\n')
-                speak(message[0]) 
+                p.send(messages.NOT_YET)
+                speak(key) 
         else:  #no person ID given
-            p.write('not yet\n')
-            speak(message[0])
+            p.send(messages.NOT_YET)
+            speak(key)
     
 #keys for phrases and delay should all match
     
@@ -76,14 +79,15 @@ delay["turnAround"] = 3
 names = ["Daniel", "Chris", "Cassie"]
 
 #initial setup for interprocess communication
-p = IPC.process(True, "phrasesToSay")
+p = IPC.process(True, "phrasesToSay", framed=True)
 p.setOnReadLine(onLineRead)
-IPC.InitSync()
+
+p.startHeartbeat() #tell master controller that it is still running, even while speaking
 
 #tell master controller that it is ready to speak
-p.write('ready\n')
+p.send(messages.READY)
 
 #main loop to run and communicate with master controller
+#each command is handled as soon as it arrives
 while True:
-    p.tryReadLine()
-    IPC.Sync()
+    p.readLine()
@@ -0,0 +1,115 @@
+import time
+
+from threading import Condition, Lock
+
+class RingBuffer(object):
+    """A fixed-size byte FIFO shared between a producer thread and a consumer
+    such as a pyaudio callback. Writes block while the buffer is full, reads
+    never block. A producer that stalls can be given up on, so padded reads
+    don't go on forever
+    """
+
+    def __init__(self, capacity, frame_size=1, stall_timeout=None,
+            on_stall=None):
+        """Constructor for RingBuffer
+
+        Parameters:
+        capacity {int} The number of bytes the buffer holds
+        frame_size {int} The number of bytes of a frame, e.g. the sample
+                         width times the channels of audio. Padded reads
+                         never split a frame
+        stall_timeout {float} Optional. The number of seconds a read may find
+                              the buffer short with nothing written before
+                              the buffer is closed
+        on_stall {callable} Optional. Called with no arguments when the
+                            buffer is closed because the producer stalled
+        """
+        self.capacity = capacity
+        self.frame_size = frame_size
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+        self._last_write = time.time()
+        self._buf = bytearray(capacity)
+        self._start = 0 # index of the oldest byte
+        self._size = 0 # number of bytes stored
+        self._closed = False
+        self._cond = Condition(Lock())
+
+    def __len__(self):
+        with self._cond:
+            return self._size
+
+    @property
+    def closed(self):
+        """Whether the producer is done writing
+        """
+        with self._cond:
+            return self._closed
+
+    def close(self):
+        """Mark the end of the data. Readers get what is left and then empty
+        reads
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def write(self, data):
+        """Append `data`, waiting for room when the buffer is full
+        """
+        data = memoryview(data)
+        while len(data):
+            with self._cond:
+                while self._size == self.capacity and not self._closed:
+                    self._cond.wait(0.1)
+                if self._closed:
+                    return
+                end = (self._start + self._size) % self.capacity
+                n = min(len(data), self.capacity - self._size,
+                        self.capacity - end)
+                self._buf[end:end + n] = data[:n].tobytes()
+                self._size += n
+                self._last_write = time.time()
+                self._cond.notify_all()
+            data = data[n:]
+
+    def read(self, n, pad=b''):
+        """Take up to `n` bytes. If fewer are stored and the buffer isn't
+        closed, only whole frames are taken and the result is filled up to
+        exactly `n` bytes with repeats of `pad`, e.g. silence for an audio
+        callback that must always return a full buffer
+        """
+        stalled = False
+        with self._cond:
+            if self._size < n and not self._closed and \
+                    self.stall_timeout is not None and \
+                    time.time() - self._last_write > self.stall_timeout:
+                self._closed = stalled = True
+            k = min(n, self._size)
+            if k < n and pad and not self._closed:
+                k -= k % self.frame_size # keep the stream aligned to frames
+            first = min(k, self.capacity - self._start)
+            data = bytes(self._buf[self._start:self._start + first]) + \
+                   bytes(self._buf[:k - first])
+            self._start = (self._start + k) % self.capacity
+            self._size -= k
+            self._cond.notify_all()
+            closed = self._closed
+        if stalled and self.on_stall:
+            self.on_stall()
+        if k < n and pad and not closed:
+            missing = n - k
+            data += (pad * ((missing + len(pad) - 1) // len(pad)))[:missing]
+        return data
+
+    def wait(self, n, timeout=None):
+        """Wait until at least `n` bytes are stored or the buffer is closed
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._size < n and not self._closed:
+                remaining = 0.1 if end is None else end - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._size >= n
@@ -0,0 +1,171 @@
+"""A shared-memory ring of skeleton frames. KinectMonitor publishes every
+tracked skeleton of every sensor frame, with all the joints and their
+confidences, and any process can read the latest ones at sensor rate without
+going through a pipe or taking a lock.
+
+The ring is a NumPy structured array in memory shared through mmap, which
+stands in for multiprocessing.shared_memory on Python 2. On Windows the
+mapping is named and backed by the page file. Elsewhere it is backed by a
+file in the temp directory. A header holds the number of frames published
+so far, and every slot holds the number of the frame in it. The writer
+clears a slot's number while it overwrites the slot, so a reader that sees
+the same number before and after copying a slot has a consistent frame.
+
+    python skeleton_bus.py # print the frames as they are published
+"""
+from __future__ import print_function
+
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# in the order of the NiTE joints, see nitepy
+JOINTS = ('Head', 'Neck', 'L_Sh', 'R_Sh', 'L_Elbow', 'R_Elbow', 'L_Hand',
+          'R_Hand', 'Torso', 'L_Hip', 'R_Hip', 'L_Knee', 'R_Knee', 'L_Foot',
+          'R_Foot')
+
+MAGIC = b'LSKB'
+HEADER = np.dtype([('magic', 'S4'), ('n_slots', '<u4'), ('seq', '<u8')])
+FRAME = np.dtype([('seq', '<u8'), # number of the frame, from 1. 0 while written
+                  ('time', '<f8'),
+                  ('skeleton', '<i4'),
+                  ('person', '<i4'), # negative if not recognized
+                  ('joints', '<f4', (len(JOINTS), 3)), # x, y, z in mm
+                  ('confidence', '<f4', (len(JOINTS),))])
+
+DEFAULT_NAME = 'lily_skeletons'
+
+class SkeletonBusError(Exception):
+    pass
+
+class SkeletonBus(object):
+    """A ring of the last `n_slots` skeleton frames shared between processes.
+    There should be one writer, which creates the bus
+    """
+
+    def __init__(self, name=DEFAULT_NAME, n_slots=256, create=False):
+        """Constructor for SkeletonBus
+
+        Parameters:
+        name {str} The name of the bus. Every process must use the same
+        n_slots {int} The number of frames kept. Every process must use the
+                      same
+        create {bool} Whether this process is the writer. The bus is cleared
+        """
+        self.name = name
+        self.n_slots = n_slots
+        size = HEADER.itemsize + n_slots * FRAME.itemsize
+        if sys.platform == 'win32':
+            self._mmap = mmap.mmap(-1, size, tagname=name)
+        else:
+            path = os.path.join(tempfile.gettempdir(), name + '.skb')
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        self._header = np.frombuffer(self._mmap, HEADER, 1)[0:1]
+        self._ring = np.frombuffer(self._mmap, FRAME, n_slots, HEADER.itemsize)
+        if create:
+            self._header['seq'] = 0
+            self._ring['seq'] = 0
+            self._header['n_slots'] = n_slots
+            self._header['magic'] = MAGIC
+        elif self._header['magic'][0] == MAGIC and \
+                self._header['n_slots'][0] != n_slots:
+            raise SkeletonBusError('The bus %s has %d slots, not %d' %
+                                   (name, self._header['n_slots'][0], n_slots))
+
+    @property
+    def seq(self):
+        """The number of frames published so far
+        """
+        return int(self._header['seq'][0])
+
+    def publish(self, skeleton, person, joints, confidence, t=None):
+        """Publish a frame of a skeleton
+
+        Parameters:
+        skeleton {int} The skeleton ID
+        person {int} The person ID, negative if the person isn't recognized
+        joints {array} The x, y and z of each of JOINTS
+        confidence {array} The confidence of each of JOINTS
+        t {float} Optional. When the frame was taken. Defaults to now
+        """
+        seq = self.seq + 1
+        i = (seq - 1) % self.n_slots
+        slot = self._ring[i:i + 1]
+        slot['seq'] = 0
+        slot['time'] = time.time() if t is None else t
+        slot['skeleton'] = skeleton
+        slot['person'] = person
+        slot['joints'] = joints
+        slot['confidence'] = confidence
+        slot['seq'] = seq
+        self._header['seq'] = seq
+
+    def latest(self, skeleton=None):
+        """Returns a copy of the latest frame, or of the latest frame of
+        `skeleton`, as a record of FRAME, or None if there is none
+        """
+        frames, _ = self.since(0)
+        if skeleton is not None:
+            frames = frames[frames['skeleton'] == skeleton]
+        return frames[-1] if len(frames) else None
+
+    def since(self, seq):
+        """Returns copies of the frames published after frame `seq` that are
+        still in the ring, oldest first, and the number of the last frame,
+        to pass as `seq` next time
+        """
+        if self._header['magic'][0] != MAGIC: # the writer hasn't started
+            return np.empty(0, FRAME), seq
+        last = self.seq
+        first = max(seq + 1, last - self.n_slots + 1, 1)
+        if first > last:
+            return np.empty(0, FRAME), last
+        slots = np.arange(first - 1, last) % self.n_slots
+        frames = self._ring[slots] # fancy indexing copies
+        # drop the frames that were being overwritten while they were copied
+        expected = np.arange(first, last + 1, dtype=FRAME['seq'])
+        ok = (frames['seq'] == expected) & \
+             (self._ring['seq'][slots] == expected)
+        return frames[ok], last
+
+    def close(self):
+        self._header = self._ring = None
+        self._mmap.close()
+
+def read_skeleton(lib, track, user):
+    """Returns the joints and confidences of user index `user` from the
+    nitepy library `lib`, to publish
+    """
+    joints = np.empty((len(JOINTS), 3), np.float32)
+    confidence = np.empty(len(JOINTS), np.float32)
+    for i, joint in enumerate(JOINTS):
+        name = 'getUserSkeleton' + joint
+        joints[i] = (getattr(lib, name + 'X')(track, user),
+                     getattr(lib, name + 'Y')(track, user),
+                     getattr(lib, name + 'Z')(track, user))
+        confidence[i] = getattr(lib, name + 'Conf')(track, user)
+    return joints, confidence
+
+def main():
+    bus = SkeletonBus()
+    seq = bus.seq
+    while True:
+        frames, seq = bus.since(seq)
+        for f in frames:
+            print('%d %.3f skeleton %d person %d torso %s' %
+                  (f['seq'], f['time'], f['skeleton'], f['person'],
+                   f['joints'][JOINTS.index('Torso')]))
+        time.sleep(1. / 30)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from threading import Lock
+
+from parsers import parse, get_intent
+from timeout import pool
+
+class SpeculativeParser(object):
+    """Parses interim transcripts of an utterance while it is still being
+    spoken. Once `n_stable` consecutive interim transcripts agree on an
+    intent from `candidates`, the intent is considered stable and its
+    response can be committed without waiting for the final transcript
+    """
+
+    def __init__(self, workspace_id, candidates=None, n_stable=2, t=0.8,
+            grammar=None, parse_fct=None):
+        """Constructor for SpeculativeParser
+
+        Parameters:
+        workspace_id {str} The workspace the transcripts are parsed with
+        candidates {list} The intents that may be committed early, e.g. the
+                          neighbors of the current node. None means any
+                          intent
+        n_stable {int} The number of consecutive interim transcripts that
+                       must agree before an intent is stable
+        t {float} The confidence threshold passed to get_intent
+        grammar {dict} Optional. The grammar transcripts are parsed with, see
+                       parsers.parse
+        parse_fct {callable} Optional. Used instead of parsers.parse
+        """
+        self.workspace_id = workspace_id
+        self.candidates = set(candidates) if candidates is not None else None
+        self.n_stable = n_stable
+        self.t = t
+        self.grammar = grammar
+        self.parse_fct = parse_fct or parse
+        self._lock = Lock()
+        self._futures = {} # transcript -> Future of its response
+        self._results = [] # (seq, transcript, response) in completion order
+        self._seq = 0
+        self._stable = None
+
+    def feed(self, transcript):
+        """Start parsing the interim transcript `transcript` in the background
+        """
+        if not transcript:
+            return
+        with self._lock:
+            if transcript in self._futures:
+                return
+            seq = self._seq
+            self._seq += 1
+            future = pool.submit(self.parse_fct, transcript, self.workspace_id,
+                                 self.grammar)
+            self._futures[transcript] = future
+        future.add_done_callback(
+                lambda f: self._on_parsed(seq, transcript, f))
+
+    def is_stable(self):
+        """Whether an intent has stabilized
+        """
+        with self._lock:
+            return self._stable is not None
+
+    def commit(self, transcript=None):
+        """Return the response for the utterance. The response of the stable
+        intent is used if there is one, otherwise the final transcript
+        `transcript` is parsed, reusing a speculative parse of the same text
+
+        Returns: {tuple} The committed transcript and its response, or
+                 (None, None) if there is nothing to commit
+        """
+        with self._lock:
+            if self._stable is not None:
+                return self._stable
+            future = self._futures.get(transcript)
+        if not transcript:
+            return None, None
+        if future is not None:
+            try:
+                return transcript, future.result()
+            except Exception:
+                pass # fall back to a fresh parse
+        return transcript, self.parse_fct(transcript, self.workspace_id,
+                                          self.grammar)
+
+    def _on_parsed(self, seq, transcript, future):
+        try:
+            response = future.result(timeout=0)
+        except Exception:
+            return
+        with self._lock:
+            self._results.append((seq, transcript, response))
+            self._results.sort(key=lambda r: r[0])
+            recent = self._results[-self.n_stable:]
+            if len(recent) < self.n_stable or self._stable is not None:
+                return
+            intents = set(get_intent(r[2], self.t) for r in recent)
+            if len(intents) != 1:
+                return
+            intent = intents.pop()
+            if intent and (self.candidates is None or intent in self.candidates):
+                self._stable = recent[-1][1:]
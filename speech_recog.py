@@ -1,31 +1,346 @@
+import audioop
+import collections
+import math
+import os
+import string
 import speech_recognition as sr
 
+from threading import Event, Lock, Thread
+from timeout import pool, call_with_deadline, TimeoutError
+from vad import VoiceDetector
+
 r = sr.Recognizer()
 r.pause_threshold = 1
 r.energy_threshold = 2200
 
-def get_input(): # TODO: add keyword recognition?
+# 'google' uses the Google Speech API and falls back to PocketSphinx when it
+# fails or is too slow, 'sphinx' only recognizes offline
+BACKEND = os.environ.get('LILY_STT_BACKEND', 'google')
+DEADLINE = 5 # seconds to wait for an online transcription
+# phrases up to this many seconds long are first spotted offline when there
+# is a vocabulary, which is much faster than a round-trip
+SHORT_PHRASE = 2.
+# the fraction of a short phrase the spotted keywords must span for them to
+# be taken without asking Google, since keyword spotting also fires on
+# words inside other speech that merely sound alike
+KEYWORD_COVERAGE = 0.6
+FRAME_RATE = 100. # PocketSphinx frames per second
+
+vad = VoiceDetector()
+# (phrase, sensitivity) pairs PocketSphinx listens for, see set_vocabulary
+keyword_entries = None
+
+class _Listener(object):
+    """A pending request for the next phrase
+    """
+
+    def __init__(self, on_partial, on_speech, interval):
+        self.on_partial = on_partial
+        self.on_speech = on_speech
+        self.interval = interval
+        self.frames = None
+        self.done = Event()
+
+class CaptureService(object):
+    """Keeps the microphone open and reads it on a background thread. The
+    energy threshold is calibrated once and then tracked while nobody is
+    talking, and the last `pre_roll` seconds of audio are kept in a ring
+    buffer, so a listen starts instantly and the first syllable of a phrase
+    is never clipped. A phrase only goes to a listen that was already waiting
+    when it started, so speech from before the listen, e.g. the robot's own
+    voice, is never taken for the answer. While `playing` returns True the
+    speakers are likely to be picked up, so a phrase has to be `echo_ratio`
+    times louder than the threshold to start
+    """
+
+    def __init__(self, recognizer=r, pre_roll=0.5, calibration=1.,
+            echo_ratio=3.):
+        """Constructor for CaptureService
+
+        Parameters:
+        recognizer {sr.Recognizer} The recognizer whose energy_threshold,
+                                   pause_threshold and dynamic energy
+                                   settings are used
+        pre_roll {float} The number of seconds of audio kept from before a
+                         phrase starts
+        calibration {float} The number of seconds of ambient noise used to
+                            calibrate the energy threshold on start
+        echo_ratio {float} How many times the energy threshold the input has
+                           to reach for a phrase to start during playback
+        """
+        self.recognizer = recognizer
+        self.pre_roll = pre_roll
+        self.calibration = calibration
+        self.echo_ratio = echo_ratio
+        self.playing = None # callable, e.g. AudioOutput.playing
+        self.source = None
+        self._lock = Lock()
+        self._listener = None
+        self._in_phrase = False
+        self._thread = None
+
+    def start(self):
+        """Open the microphone, calibrate and start capturing. Does nothing if
+        the service is already running
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.source = sr.Microphone()
+            self.source.__enter__()
+            self.recognizer.adjust_for_ambient_noise(self.source,
+                                                     duration=self.calibration)
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def listen(self, on_partial=None, should_stop=None, interval=0.75,
+            on_speech=None):
+        """Wait for the next phrase. A phrase already under way when this is
+        called is skipped
+
+        Parameters:
+        on_partial {callable} Called with the sr.AudioData recorded so far
+                              every `interval` seconds of speech
+        should_stop {callable} Polled while waiting. Listening stops as soon
+                               as it returns True
+        interval {float} See `on_partial`
+        on_speech {callable} Called when the phrase starts
+
+        Returns: {sr.AudioData} The phrase, or None if `should_stop` ended
+                 the listen
+        """
+        self.start()
+        listener = _Listener(on_partial, on_speech, interval)
+        with self._lock:
+            self._listener = listener
+        try:
+            while not listener.done.wait(0.05):
+                if should_stop and should_stop():
+                    return None
+        finally:
+            with self._lock:
+                if self._listener is listener:
+                    self._listener = None
+        return self._audio(listener.frames)
+
+    def _run(self):
+        source = self.source
+        rec = self.recognizer
+        seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
+        pause_buffers = int(math.ceil(rec.pause_threshold / seconds_per_buffer))
+        pre_roll = collections.deque(
+                maxlen=int(math.ceil(self.pre_roll / seconds_per_buffer)))
+        frames = []
+        owner = None # the listener that was waiting when the phrase started
+        n_quiet = 0
+        n_since_interim = 0
+        while True:
+            buf = source.stream.read(source.CHUNK)
+            energy = audioop.rms(buf, source.SAMPLE_WIDTH)
+            with self._lock:
+                listener = self._listener
+                in_phrase = self._in_phrase
+
+            if not in_phrase:
+                pre_roll.append(buf)
+                if self.playing and self.playing():
+                    # the robot's own voice isn't ambient noise to adjust to
+                    if energy <= rec.energy_threshold * self.echo_ratio:
+                        continue
+                elif energy <= rec.energy_threshold:
+                    if rec.dynamic_energy_threshold:
+                        # the same adjustment Recognizer.listen makes
+                        damping = rec.dynamic_energy_adjustment_damping ** \
+                                seconds_per_buffer
+                        target = energy * rec.dynamic_energy_ratio
+                        rec.energy_threshold = rec.energy_threshold * damping + \
+                                target * (1 - damping)
+                    continue
+                frames = list(pre_roll)
+                pre_roll.clear()
+                n_quiet = 0
+                n_since_interim = 0
+                owner = listener
+                with self._lock:
+                    self._in_phrase = True
+                if owner and owner.on_speech:
+                    owner.on_speech()
+                continue
+
+            frames.append(buf)
+            n_quiet = 0 if energy > rec.energy_threshold else n_quiet + 1
+            n_since_interim += 1
+            if owner and owner is listener and owner.on_partial and \
+                    n_since_interim * seconds_per_buffer >= owner.interval:
+                n_since_interim = 0
+                owner.on_partial(self._audio(frames))
+            if n_quiet >= pause_buffers:
+                with self._lock:
+                    self._in_phrase = False
+                    # a phrase that started before the listen isn't its answer
+                    if owner and owner is self._listener:
+                        self._listener = None
+                    else:
+                        owner = None
+                if owner:
+                    owner.frames = frames
+                    owner.done.set()
+                frames = []
+                owner = None
+
+    def _audio(self, frames):
+        return sr.AudioData(b''.join(frames), self.source.SAMPLE_RATE,
+                            self.source.SAMPLE_WIDTH)
+
+capture = CaptureService()
+
+def get_input(on_speech=None, grammar=None):
     """Using audio data recorded from the microphone, do speech to text on the
     audio and return the transcription
+
+    Parameters:
+    on_speech {callable} Called as soon as the user starts talking, e.g. to
+                         stop TTS playback
+    grammar {dict} Optional. What the user is expected to say, like
+                   Story.grammar returns. Its `phrases` become the vocabulary
+                   of offline recognition
     """
     # FOR DEBUGGING 
     # return raw_input('input: ')
     
     t = 0.8 # confidence threshold
+    set_vocabulary(grammar['phrases'] if grammar else None)
     s = None
     while not s:
-        # use the default microphone as the audio source
-        with sr.Microphone() as source:
-            r.adjust_for_ambient_noise(source, duration = 0.5)
-            print "listening..."
-            audio = r.listen(source)
+        print "listening..."
+        audio = capture.listen(on_speech=on_speech)
         try:
-            s = r.recognize_google(audio)
+            s = recognize(audio)
         except sr.UnknownValueError:
             pass
     
     return s
 
+def stream_input(on_partial=None, should_stop=None, interval=0.75,
+        on_speech=None, grammar=None):
+    """Like get_input, but while the user is still talking the audio captured
+    so far is transcribed in the background every `interval` seconds and
+    passed to `on_partial`
+
+    Parameters:
+    on_partial {callable} Called with each interim transcription. It may be
+                          called from another thread
+    should_stop {callable} Polled while recording. Recording stops as soon as
+                           it returns True
+    interval {float} The number of seconds of speech between interim
+                     transcriptions
+    on_speech {callable} Called as soon as the user starts talking
+    grammar {dict} Optional. See get_input
+
+    Returns: {str} The final transcription, or None if `should_stop` ended the
+             recording early
+    """
+    set_vocabulary(grammar['phrases'] if grammar else None)
+    on_audio = None
+    if on_partial:
+        on_audio = lambda audio: _transcribe_async(audio, on_partial)
+    while True:
+        print "listening..."
+        audio = capture.listen(on_audio, should_stop, interval, on_speech)
+        if audio is None:
+            return None
+        try:
+            return recognize(audio)
+        except sr.UnknownValueError:
+            pass
+
+def _transcribe_async(audio, callback):
+    """Transcribe `audio` on the worker pool and pass the transcription to
+    `callback` if there is one
+    """
+    def done(future):
+        try:
+            s = future.result(timeout=0)
+        except Exception: # unintelligible audio or a failed request
+            return
+        if s:
+            callback(s)
+
+    pool.submit(recognize, audio).add_done_callback(done)
+
+def set_vocabulary(phrases, sensitivity=0.8):
+    """Limit offline recognition to the short commands in `phrases`, e.g.
+    the ones that make sense at the current node of a story
+
+    Parameters:
+    phrases {iterable} The phrases to listen for, or None for open vocabulary
+    sensitivity {float} How eagerly PocketSphinx reports a phrase, from 0 to 1
+    """
+    global keyword_entries
+    if phrases is None:
+        keyword_entries = None
+        return
+    table = {ord(c): u' ' for c in string.punctuation}
+    entries = set()
+    for phrase in phrases:
+        phrase = u' '.join(unicode(phrase).lower().translate(table).split())
+        if phrase:
+            entries.add((phrase, sensitivity))
+    keyword_entries = sorted(entries) or None
+
+def recognize(audio):
+    """Transcribe the sr.AudioData `audio`. Audio without speech is rejected
+    locally instead of being sent off, and the silence around speech is
+    trimmed
+
+    Raises: {sr.UnknownValueError} If there is no speech or it couldn't be
+            understood
+    """
+    if not vad.is_speech(audio, r.energy_threshold):
+        raise sr.UnknownValueError()
+    audio = vad.trim(audio, r.energy_threshold)
+    if BACKEND == 'sphinx':
+        return _recognize_offline(audio)
+    duration = float(len(audio.frame_data)) / \
+            (audio.sample_rate * audio.sample_width)
+    if keyword_entries and duration <= SHORT_PHRASE:
+        try:
+            return _spot_keywords(audio, duration)
+        except sr.UnknownValueError:
+            pass
+    try:
+        return call_with_deadline(r.recognize_google, DEADLINE, audio)
+    except (TimeoutError, sr.RequestError):
+        return _recognize_offline(audio)
+
+def _spot_keywords(audio, duration):
+    """Spot the phrases of the vocabulary in the `duration` seconds of
+    `audio` offline
+
+    Raises: {sr.UnknownValueError} If no phrase was spotted or the phrases
+            spotted span less than KEYWORD_COVERAGE of the audio
+    """
+    try:
+        decoder = r.recognize_sphinx(audio, keyword_entries=keyword_entries,
+                                     show_all=True)
+    except sr.RequestError: # PocketSphinx isn't installed
+        raise sr.UnknownValueError()
+    hyp = decoder.hyp()
+    if hyp is None:
+        raise sr.UnknownValueError()
+    spotted = sum(seg.end_frame - seg.start_frame + 1
+                  for seg in decoder.seg()) / FRAME_RATE
+    if spotted < KEYWORD_COVERAGE * duration:
+        raise sr.UnknownValueError()
+    return hyp.hypstr
+
+def _recognize_offline(audio):
+    try:
+        return r.recognize_sphinx(audio, keyword_entries=keyword_entries)
+    except sr.RequestError: # PocketSphinx isn't installed
+        raise sr.UnknownValueError()
+
 def main():
     print(get_input())
 
@@ -1,8 +1,22 @@
+import json
+import shutil
+import tempfile
+import time
 import unittest
 import mock
 
-from story import Story, StoryError, get_keys, get_value
+import local_nlu
+import parsers
+import story_format
+import story_journal
+
+from story import Story, StoryError
+from conditions import Condition
 from copy import copy
+from StringIO import StringIO
+from threading import Event, Thread
+from ring_buffer import RingBuffer
+from tts_cache import AudioCache, template_fragments, warm_up
 
 class StoryTests(unittest.TestCase):
 
@@ -91,20 +105,15 @@ class StoryTests(unittest.TestCase):
         self.s.require_visit('c', 'a', 'b')
 
         self.assertFalse('a' in self.s.visited)
-        condition = self.s.run_conditions('b')[0]
-        self.assertFalse(condition())
-        condition = self.s.run_conditions('c')[0]
-        self.assertFalse(condition())
+        self.assertFalse(self.s._is_runnable('b'))
+        self.assertFalse(self.s._is_runnable('c'))
 
         self.s.current = 'a'
-        condition = self.s.run_conditions('b')[0]
-        self.assertTrue(condition())
-        condition = self.s.run_conditions('c')[0]
-        self.assertFalse(condition())
+        self.assertTrue(self.s._is_runnable('b'))
+        self.assertFalse(self.s._is_runnable('c'))
 
         self.s.current = 'b'
-        condition = self.s.run_conditions('c')[0]
-        self.assertTrue(condition())
+        self.assertTrue(self.s._is_runnable('c'))
 
     def test_run_conditions2(self):
         l = ['a', 'b', 'c', 'd']
@@ -115,22 +124,71 @@ class StoryTests(unittest.TestCase):
         self.s.check_context_for('c', apples=6)
         self.s.check_context_for('d', 'oranges')
 
-        condition = self.s.run_conditions('b')[0]
-        self.assertTrue(condition())
-        condition = self.s.run_conditions('c')[0]
-        self.assertFalse(condition())
-        condition = self.s.run_conditions('d')[0]
-        self.assertFalse(condition())
+        self.assertTrue(self.s._is_runnable('b'))
+        self.assertFalse(self.s._is_runnable('c'))
+        self.assertFalse(self.s._is_runnable('d'))
         
         updated_context = {'apples': 6, 'oranges': 0}
         self.s.update_context(updated_context)
 
-        condition = self.s.run_conditions('b')[0]
-        self.assertTrue(condition())
-        condition = self.s.run_conditions('c')[0]
-        self.assertTrue(condition())
-        condition = self.s.run_conditions('d')[0]
-        self.assertTrue(condition())
+        self.assertTrue(self.s._is_runnable('b'))
+        self.assertTrue(self.s._is_runnable('c'))
+        self.assertTrue(self.s._is_runnable('d'))
+
+    def test_custom_condition(self):
+        class VisitedAndHasKey(Condition):
+            nodes = ('a',)
+            keys = ('apples',)
+            def __call__(self, visited, context):
+                return 'a' in visited and 'apples' in context
+        self.assertRaises(TypeError, Condition)
+        self.s.add_nodes_from(['a', 'b', 'c'])
+        self.s.add_run_condition('b', VisitedAndHasKey())
+        self.s.update_context({'apples': 5})
+        self.assertFalse(self.s._is_runnable('b'))
+        self.s.current = 'a'
+        self.assertTrue(self.s._is_runnable('b'))
+        self.s.context = {}
+        self.assertFalse(self.s._is_runnable('b'))
+
+    def test_remove_node(self):
+        self.s.add_nodes_from(['a', 'b', 'c'])
+        self.s.require_visit('b', 'a')
+        self.s.remove_node('b')
+        self.s.add_node('b')
+        self.assertTrue(self.s._is_runnable('b'))
+        self.s.check_context_for('c', 'apples')
+        self.s.remove_nodes_from(['c'])
+        self.s.add_node('c')
+        self.assertTrue(self.s._is_runnable('c'))
+
+    def test_inherited_mutators(self):
+        self.s.add_nodes_from(['a', 'b', 'c'])
+        self.s.add_star(['a', 'b', 'c'])
+        self.assertTrue(sorted(self.s.runnable_successors('a')) == ['b', 'c'])
+        self.s.remove_edges_from([('a', 'b')])
+        self.assertTrue(self.s.runnable_successors('a') == ['c'])
+        self.s.require_visit('c', 'b')
+        self.s.clear()
+        self.s.add_nodes_from(['a', 'c'])
+        self.s.add_path(['a', 'c'])
+        self.assertTrue(self.s.runnable_successors('a') == ['c'])
+
+    def test_runnable_successors(self):
+        l = ['a', 'b', 'c', 'd']
+        self.s.add_nodes_from(l)
+        self.s.add_edges_from([('a', 'b'), ('a', 'c'), ('a', 'd')])
+        self.s.require_visit('c', 'b')
+        self.s.check_context_for('d', apples=6)
+        self.s.current = 'a'
+        self.assertTrue(self.s.runnable_successors() == ['b'])
+
+        self.s.update_context({'apples': 6})
+        self.assertTrue(self.s.runnable_successors() == ['b', 'd'])
+        self.s.current = 'b'
+        self.assertTrue(self.s.runnable_successors('a') == ['b', 'c', 'd'])
+        self.s.context = {}
+        self.assertTrue(self.s.runnable_successors('a') == ['b', 'c'])
 
     def test_context(self):
         d = {'a': 1, 'b': 2}
@@ -158,6 +216,26 @@ class StoryTests(unittest.TestCase):
             self.s()
             self.assertTrue(self.s.current == next(current))
 
+    def test_dynamic_events(self):
+        l = ['a', 'b', 'c']
+        self.s.add_nodes_from(l)
+        self.s.add_edge('a', 'b')
+        self.assertTrue(self.s.compile().sample('b') == 'b')
+
+        self.s.add_dynamic_event('b', 'c', 1.)
+        self.assertTrue(self.s._select('b') == 'c')
+        self.s.remove_dynamic_event('b', 'c')
+        self.assertTrue(self.s._select('b') == 'b')
+
+        s1, s2 = Story(seed=1), Story(seed=1)
+        for s in (s1, s2):
+            s.add_nodes_from(l)
+            s.add_dynamic_event('b', 'c', 0.5)
+        samples1 = [s1._select('b') for _ in range(20)]
+        samples2 = [s2._select('b') for _ in range(20)]
+        self.assertTrue(samples1 == samples2)
+        self.assertTrue(set(samples1) == set(['b', 'c']))
+
 
     '''
     def test_verify(self):
@@ -172,5 +250,208 @@ class StoryTests(unittest.TestCase):
         self.s.node[foo]['arg_dict']['name'] = 'incorrect_name_key'
         self.s.verify()
     '''
+
+class LocalNLUTests(unittest.TestCase):
+
+    MOVIE = '569456a8-facf-431d-a963-493d905b77ea'
+
+    def test_bare_entity(self):
+        for s, intent, entity in [('minions', 'buy_ticket', 'movies'),
+                                  ('Inside Out', 'buy_ticket', 'movies'),
+                                  ('soda', 'order_food', 'snacks')]:
+            response = local_nlu.parse(s, self.MOVIE)
+            self.assertTrue(response['intents'][0]['intent'] == intent)
+            self.assertTrue(response['intents'][0]['confidence'] > 0.5)
+            self.assertTrue(response['entities'][0]['entity'] == entity)
+
+    def test_grammar_entity(self):
+        s = Story(workspace_id=self.MOVIE, use_grammar=True)
+        s.context = {'movie_names': ['inside out', 'minions']}
+        grammar = s.grammar('buy_ticket', 'movie_names')
+        self.assertTrue('minions' in grammar['phrases'])
+        for utterance in ['minions', 'minion']:
+            response = parsers.parse_with_grammar(utterance, self.MOVIE,
+                                                  grammar)
+            self.assertTrue(response is not None)
+            self.assertTrue(response['intents'][0]['intent'] == 'buy_ticket')
+            self.assertTrue(response['entities'][0]['value'] == 'minions')
+
+    def test_grammar_off_topic(self):
+        s = Story(workspace_id=self.MOVIE, use_grammar=True)
+        s.context = {'movie_names': ['inside out', 'minions', 'home']}
+        grammar = s.grammar('buy_ticket', 'movie_names')
+        for utterance in ['what is the weather like at home',
+                          'is it going to rain at home']:
+            self.assertTrue(parsers.parse_with_grammar(
+                    utterance, self.MOVIE, grammar) is None)
+
+class RingBufferTests(unittest.TestCase):
+
+    def test_pad_frames(self):
+        ring = RingBuffer(16, frame_size=2)
+        ring.write(b'abc')
+        self.assertTrue(ring.read(6, pad=b'..') == b'ab....')
+        ring.write(b'd')
+        self.assertTrue(ring.read(4, pad=b'..') == b'cd..')
+
+    def test_stall(self):
+        class StallingResponse(object):
+            def __init__(self):
+                self.closed = Event()
+            def iter_content(self, chunk_size):
+                yield b'\1\0' * 8
+                self.closed.wait(5) # the download stalls
+        response = StallingResponse()
+        ring = RingBuffer(64, frame_size=2, stall_timeout=0.2,
+                          on_stall=response.closed.set)
+        def fill():
+            for chunk in response.iter_content(4):
+                ring.write(chunk)
+            ring.close()
+        t = Thread(target=fill)
+        t.daemon = True
+        t.start()
+        start = time.time()
+        n_bytes = 0
+        while time.time() - start < 2: # read like AudioOutput does
+            data = ring.read(8, pad=b'\0\0')
+            n_bytes += len(data)
+            if len(data) < 8:
+                break
+            time.sleep(0.01)
+        self.assertTrue(ring.closed)
+        self.assertTrue(response.closed.is_set())
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(n_bytes % 2 == 0)
+
+class AudioCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_warm_fragments(self):
+        cache = AudioCache(self.path)
+        s = Story()
+        s.add_node('a')
+        s.context = {'movie_names': ['minions']}
+        s.add_say('a', 'We have tickets for {movie_names} . Enjoy ')
+        warm_up(template_fragments(s), lambda text: cache.put('v', text, 'x'))
+        # the pieces as text_to_speech.template_pieces looks them up
+        for piece in ['We have tickets for', 'minions', '. Enjoy']:
+            self.assertTrue(cache.get('v', piece) == 'x')
+        self.assertTrue(cache.get('v', ' We have tickets for ') == 'x')
+
+class StoryFormatTests(unittest.TestCase):
+
+    def setUp(self):
+        self.s = Story(workspace_id='569456a8-facf-431d-a963-493d905b77ea')
+        self.s.add_nodes_from(['movie_greeting', 'box_office', 'concessions',
+                               'auditorium'])
+        self.s.add_edges_from([('movie_greeting', 'box_office'),
+                               ('movie_greeting', 'concessions'),
+                               ('box_office', 'auditorium'),
+                               ('concessions', 'auditorium')])
+        self.s.add_undirected_edges_from([('box_office', 'concessions')])
+        self.s.context = {'name': 'Ann', 'movie_choice': None,
+                          'movie_names': ['inside out', 'minions'],
+                          'menu': ['soda', 'popcorn'], 'bought': []}
+        self.s.add_say('box_office', 'Which movie? We have {movie_names}')
+        self.s.add_listen('box_office', intent='buy_ticket',
+                          entity_type='movies', n_entities=1,
+                          verify_with='movie_names', context_key='movie_choice',
+                          fail_message="We're not showing that")
+        self.s.add_say('concessions', 'What can I get for you?')
+        self.s.add_listen('concessions', intent='order_food',
+                          entity_type='snacks', verify_with='menu',
+                          context_key='bought')
+        self.s.add_play('auditorium',
+                        'https://www.youtube.com/watch?v=eisKxhjBnZ0',
+                        only_if=('movie_choice', 'minions'))
+        self.s.require_visit('auditorium', 'box_office')
+        self.s.check_context_for('auditorium', 'name',
+                                 movie_choice='minions')
+        self.s.add_dynamic_event('concessions', 'auditorium', 0.25)
+        self.s.current = 'box_office'
+
+    def round_trip(self, story):
+        f = StringIO()
+        story_format.dump(story, f)
+        f.seek(0)
+        return story_format.load(f), f.getvalue()
+
+    def test_round_trip(self):
+        loaded, text = self.round_trip(self.s)
+        self.assertTrue(sorted(loaded.nodes()) == sorted(self.s.nodes()))
+        self.assertTrue(sorted(loaded.edges()) == sorted(self.s.edges()))
+        self.assertTrue(loaded.context == self.s.context)
+        self.assertTrue(loaded.workspace_id == self.s.workspace_id)
+        self.assertTrue(loaded.node['concessions']['dynamic_events'] ==
+                        {'auditorium': 0.25})
+        for n in self.s.nodes():
+            # tuples such as only_if come back as lists
+            actions = json.loads(json.dumps(self.s.get_actions(n)))
+            self.assertTrue(loaded.get_actions(n) == actions)
+        conditions = loaded.get_run_conditions('auditorium')
+        self.assertTrue(len(conditions) == 3)
+        self.assertTrue('auditorium' not in
+                        loaded.runnable_successors('box_office'))
+        _, text2 = self.round_trip(loaded)
+        self.assertTrue(text2 == text)
+        loaded.update_context({'movie_choice': 'minions'})
+        self.assertTrue('auditorium' in loaded.runnable_successors('box_office'))
+
+    def test_start_and_visited(self):
+        # start is the current node when the story was saved. Visited nodes
+        # aren't saved, so only start counts as visited after loading
+        loaded, _ = self.round_trip(self.s)
+        self.assertTrue(loaded.current == 'box_office')
+        self.assertTrue(loaded.visited == {'box_office'})
+
+    def test_version(self):
+        f = StringIO()
+        story_format.dump(self.s, f)
+        lines = f.getvalue().splitlines(True)
+        newer = lines[0].replace('"version": %d' % story_format.FORMAT_VERSION,
+                                 '"version": %d' %
+                                 (story_format.FORMAT_VERSION + 1))
+        self.assertRaises(story_format.StoryFormatError, story_format.load,
+                          StringIO(newer + ''.join(lines[1:])))
+        self.assertRaises(story_format.StoryFormatError, story_format.load,
+                          StringIO('{"format": "other"}\n'))
+
+class StoryJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.journal = story_journal.StoryJournal(self.path + '/journal')
+        self.s = Story()
+        self.s.add_nodes_from(['a', 'b'])
+        self.s.current = 'a'
+        self.s.context = {'name': 'Ann'}
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.path)
+
+    def test_checkpoint_text_in_context(self):
+        self.journal.attach(self.s)
+        # written as {"type": "checkpoint"} but it isn't a checkpoint
+        self.s.update_context({'note': {'type': 'checkpoint'}})
+        state = self.journal.recover()
+        self.assertTrue(state['context'] == {'name': 'Ann', 'note':
+                                             {'type': 'checkpoint'}})
+        self.assertTrue(story_journal._tail(self.journal.path, 16) ==
+                        story_journal._tail(self.journal.path))
+
+    def test_sync_on_timer(self):
+        self.journal.fsync_interval = 0.05
+        with mock.patch('story_journal.os.fsync') as fsync:
+            self.journal.attach(self.s)
+            time.sleep(0.2)
+            self.assertTrue(fsync.called)
+
 if __name__ == '__main__':
     unittest.main()
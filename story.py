@@ -2,24 +2,153 @@ from __future__ import print_function
 
 import networkx as nx
 import random
+import re
+import string
+import importlib
 import inspect 
 import webbrowser
 import warnings
 
-from functools import wraps
-from parsers import parse, get_intent, get_entities
-from numpy.random import multinomial
+from array import array
+from bisect import bisect_right
+from functools import partial, wraps
+from parsers import parse, get_intent, get_entities, grammar_phrases
+from speculative import SpeculativeParser
 from copy import copy 
 from text_to_speech import englishify
+from conditions import ConditionIndex, Visited, HasKey, Equals
+
+REPEAT_MSG = "Sorry I didn't catch that. Could you repeat yourself?"
+REPHRASE_MSG = "Sorry, I didn't understand what you said. " +\
+        "Could you try rephrasing?"
+UNRECOGNIZED_MSG = "I didn't recognize something you said. " +\
+        "Could you repeat yourself?"
+# messages the story may say whatever its content, see tts_cache.warm_up
+FIXED_MESSAGES = [REPEAT_MSG, REPHRASE_MSG, UNRECOGNIZED_MSG]
+
+_FIELD_NAME = re.compile(r'[.\[]')
+_template_fields = {} # message -> context keys it refers to
 
 class StoryError(Exception):
     pass
 
+def template_fields(message):
+    """Returns the context keys the format string `message` refers to
+    """
+    fields = _template_fields.get(message)
+    if fields is None:
+        fields = set()
+        for _, field, _, _ in string.Formatter().parse(message):
+            if field:
+                # "movie.title" and "movies[0]" both need "movie(s)"
+                fields.add(_FIELD_NAME.split(field, 1)[0])
+        fields = _template_fields[message] = tuple(sorted(fields))
+    return fields
+
+def load_factory(spec):
+    """Returns a callable that builds the story named `spec` without asking
+    the visitor anything, for tools such as story_sim and tts_cache. `spec`
+    is a story module like "zoo" or "zoo_story", whose factory is
+    zoo_story_factory, or "module:function" for any other factory. A factory
+    taking a visitor `name` is passed ''. The callable can be pickled, so it
+    can be handed to story_sim.simulate
+    """
+    module_name, _, fct_name = spec.partition(':')
+    if not fct_name:
+        if not module_name.endswith('_story'):
+            module_name += '_story'
+        fct_name = module_name + '_factory'
+    try:
+        factory = getattr(importlib.import_module(module_name), fct_name)
+    except (ImportError, AttributeError) as e:
+        raise StoryError('No story factory %s: %s' % (spec, e))
+    if 'name' in inspect.getargspec(factory).args:
+        return partial(factory, name='')
+    return factory
+
+class CompiledStory(object):
+    """A read-only snapshot of a Story's graph for fast traversal, built by
+    Story.compile. The successors of every node are stored in compact arrays
+    (node i's successors are targets[offsets[i]:offsets[i + 1]]), each node
+    has a table mapping an intent to the successor it leads to, and the
+    dynamic events of every node are gathered up front
+    """
+
+    def __init__(self, story):
+        self.nodes = sorted(story.nodes())
+        self.index = dict((n, i) for i, n in enumerate(self.nodes))
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.transitions = [] # intent -> successor, per node
+        self.events = [] # (nodes, cumulative probabilities) or None, per node
+        for n in self.nodes:
+            successors = sorted(story.successors(n))
+            self.targets.extend(self.index[v] for v in successors)
+            self.offsets.append(len(self.targets))
+            # nodes are entered by the intent of the same name
+            self.transitions.append(dict((v, v) for v in successors))
+            self.events.append(self._compile_events(n, story.node[n]))
+
+    def successors(self, n):
+        i = self.index[n]
+        return [self.nodes[j] for j in
+                self.targets[self.offsets[i]:self.offsets[i + 1]]]
+
+    def is_leaf(self, n):
+        i = self.index[n]
+        return self.offsets[i] == self.offsets[i + 1]
+
+    def successor(self, n, intent):
+        """Returns the node `intent` leads to from node `n`, or None
+        """
+        return self.transitions[self.index[n]].get(intent)
+
+    def sample(self, n, rng=random):
+        """Returns the node entered when going to node `n`, which is one of
+        its dynamic events or `n` itself
+
+        Parameters:
+        n {str} The node being entered
+        rng {random.Random} The random number generator to sample with
+        """
+        events = self.events[self.index[n]]
+        if not events:
+            return n
+        nodes, cdf = events
+        # cdf[-1] may fall short of 1 by rounding or exceed it if the
+        # probabilities do
+        i = bisect_right(cdf, rng.random() * cdf[-1])
+        return nodes[min(i, len(nodes) - 1)]
+
+    def _compile_events(self, n, attrs):
+        """Returns the nodes the dynamic events of node `n` lead to and their
+        cumulative probabilities
+        """
+        dynamic_events = attrs.get('dynamic_events')
+        if not dynamic_events:
+            return None
+        # sorted so a seeded story samples the same way on every run
+        nodes = sorted(dynamic_events)
+        p_dist = [dynamic_events[v] for v in nodes]
+        total = sum(p_dist)
+        # add node to occupy leftover probability
+        if total < 1:
+            nodes.append(n)
+            p_dist.append(1. - total)
+        cdf = []
+        acc = 0.
+        for p in p_dist:
+            acc += p
+            cdf.append(acc)
+        return nodes, cdf
+
 class Story(nx.DiGraph):
     """The Story class represented as a directed graph.
     """
 
-    def __init__(self, input_fct=None, output_fct=None, workspace_id=None):
+    def __init__(self, input_fct=None, output_fct=None, workspace_id=None,
+            stream_fct=None, template_fct=None, barge_in=False,
+            use_grammar=False, seed=None, parse_fct=None, play_fct=None):
         """Constructor for Story
 
         Parameters:
@@ -28,16 +157,63 @@ class Story(nx.DiGraph):
         output_fct {callable} A callable that accepts a str and produces some
                               sort of output 
         workspace_id {str} The Watson Conversation workspace ID
+        stream_fct {callable} Optional. A callable like
+                              speech_recog.stream_input that reports interim
+                              transcriptions. When given, choosing the next
+                              node parses the interim transcriptions
+                              speculatively
+        template_fct {callable} Optional. A callable that accepts a format
+                                string and a dict of values to fill it with,
+                                like text_to_speech.speak_template. When
+                                given, say actions use it instead of
+                                output_fct
+        barge_in {bool} Whether the user may interrupt speech. Needs an
+                        input_fct (and stream_fct) that accepts an
+                        `on_speech` callback. Otherwise input waits until
+                        all speech has finished
+        use_grammar {bool} Whether to constrain recognition and parsing to
+                           what makes sense at the current node, see
+                           grammar. Needs an input_fct (and stream_fct)
+                           that accepts a `grammar` argument
+        seed {hashable} Optional. Seeds the random number generator dynamic
+                        events are sampled with, so runs can be reproduced
+        parse_fct {callable} Optional. A callable like parsers.parse that
+                             accepts the input, the workspace ID and a
+                             grammar and returns a response. Defaults to
+                             parsers.parse
+        play_fct {callable} Optional. A callable that accepts the URL of the
+                            media a play action shows. Defaults to opening
+                            it in a web browser
+
+        Output and template functions may return a handle with `wait` and
+        `cancel` methods instead of blocking, like
+        text_to_speech.speak_async. The story then carries on with the next
+        action while the message is still being spoken.
         """
         super(Story, self).__init__()
         self._current = None
         self._visited = set()
         self._context = {}
+        self._conditions = ConditionIndex() # see require_visit
+        self._context_version = 0 # bumped whenever the context is set
+        self._formatted = {} # key -> (context version, formatted value)
+        self.journal = None # see story_journal.StoryJournal.attach
         self._input_fct = None 
         self.input_fct = input_fct 
         self._output_fct = None 
         self.output_fct = output_fct
         self._is_finished = False
+        self.stream_fct = stream_fct
+        self.template_fct = template_fct
+        self.barge_in = barge_in
+        self.use_grammar = use_grammar
+        self._speaking = [] # handles of messages that may still be playing
+        self._compiled = None # see compile
+        # seeding a new generator from the OS is slow, so unseeded stories
+        # share the random module's
+        self.random = random.Random(seed) if seed is not None else random
+        self.parse_fct = parse_fct or parse
+        self.play_fct = play_fct or (lambda url: webbrowser.open(url, new=2))
 
         self.workspace_id = workspace_id
         # if dependencies:
@@ -73,11 +249,25 @@ class Story(nx.DiGraph):
     def is_finished(self):
         return self._is_finished
 
+    def is_visited(self, n):
+        """Whether node `n` has been visited. Unlike `visited`, this doesn't
+        copy the visited set
+        """
+        return n in self._visited
+
+    def get_context(self, k, default=None):
+        """Returns the context value of key `k`, or `default`. Unlike
+        `context`, this doesn't copy the context. The value mustn't be
+        mutated in place, since neither run conditions nor say actions would
+        see the change. Use update_context
+        """
+        return self._context.get(k, default)
+
     def get_actions(self, n=None):
         if n:
-            return self.node[n]['actions']
+            return self._actions(n)
         elif self._current:
-            return self.node[self._current]['actions']
+            return self._actions(self._current)
         else:
             return []
 
@@ -113,18 +303,108 @@ class Story(nx.DiGraph):
         elif node in self:
             self._current = node
             self._visited.add(node)
+            self._conditions.visit(node)
+            if self.journal:
+                self.journal.enter(node)
         else:
             raise StoryError('%s not in the story' % str(node))
 
     @context.setter
     def context(self, d):
+        changed = set(self._context) | set(d)
         self._context = copy(d)
+        self._context_version += 1
+        self._conditions.update(self._context, changed)
+        if self.journal:
+            self.journal.checkpoint()
 
     def update_context(self, d):
         """Adds the keys and values in dict `d` to the context dict
         """
         for k, v in d.iteritems():
             self._context[k] = v
+        self._context_version += 1
+        self._conditions.update(self._context, d.keys())
+        if self.journal:
+            self.journal.update(d)
+
+    def restore(self, current, visited, context):
+        """Put the story back in a saved state, e.g. one recovered from a
+        story_journal.StoryJournal
+
+        Parameters:
+        current {str} The current node
+        visited {iterable} The visited nodes
+        context {dict} The context
+        """
+        if current not in self:
+            raise StoryError('%s not in the story' % str(current))
+        self._current = current
+        self._visited = set(visited)
+        self._context = copy(context)
+        self._context_version += 1
+        self._is_finished = False
+        self._conditions.reset(self._visited, self._context)
+
+    def format_context(self, keys=None):
+        """Returns a copy of the context with list values turned into
+        English the way say actions render them. Only `keys` are included if
+        given
+        """
+        if keys is None:
+            keys = self._context.keys()
+        return dict((k, self._format_value(k)) for k in keys
+                    if k in self._context)
+
+    def grammar(self, intent=None, verify_with=''):
+        """Returns what the user can sensibly say next. Between nodes that is
+        one of the neighbors of the current node. While a listen action is
+        pending it is the action's `intent`, usually naming a value of the
+        context list `verify_with`. Neighbors whose run conditions don't hold
+        are left out
+
+        Returns: {dict} The valid `intents`, the `entities` a pending listen
+                 action accepts and the `phrases` the user is likely to
+                 say, including examples of the intents from the local NLU
+                 workspace if there is one
+        """
+        entities = []
+        if intent:
+            intents = [intent.strip()]
+            values = self._context.get(verify_with)
+            if type(values) is list:
+                if values and type(values[0]) is int: # englishify option
+                    values = values[1:]
+                entities = [str(v) for v in values]
+            phrases = list(entities)
+        else:
+            intents = self.runnable_successors()
+            phrases = [n.replace('_', ' ') for n in intents]
+        phrases += grammar_phrases(self.workspace_id, intents)
+        return {'intents': intents, 'entities': entities,
+                'phrases': sorted(set(phrases))}
+
+    def runnable_successors(self, n=None):
+        """Returns the successors of node `n` whose run conditions hold, i.e.
+        the nodes the story can go to next. Defaults to current. If current
+        is not set, returns an empty list
+        """
+        n = n or self._current
+        if not n:
+            return []
+        return [v for v in self._get_compiled().successors(n)
+                if self._conditions.is_runnable(v)]
+
+    def compile(self):
+        """Freeze the graph into a CompiledStory used to pick the next node.
+        Adding or removing nodes, edges and dynamic events, including through
+        inherited methods such as add_path and clear, discards it, and it is rebuilt the next time it is needed.
+        Call compile again after changing node attributes directly
+
+        Returns: {CompiledStory} The compiled graph
+        """
+        self._compiled = CompiledStory(self)
+        return self._compiled
 
     @input_fct.setter
     def input_fct(self, f):
@@ -150,6 +430,7 @@ class Story(nx.DiGraph):
                            'dynamic_events': None,
                            'run_conditions': None}
         super(Story, self).add_node(str(s), **node_attributes)
+        self._compiled = None
 
     def add_nodes_from(self, nodes):
         """Given a list of nodes, add them to the graph
@@ -159,75 +440,92 @@ class Story(nx.DiGraph):
                            'dynamic_events': None,
                            'run_conditions': None}
         super(Story, self).add_nodes_from(nodes, **node_attributes)
+        self._compiled = None
     
     def require_visit(self, u, *nodes):
         """Add a run condition to `u` that requires nodes in `nodes` to be 
         visited beforehand
         """
-        def check():
-            # print('checking:', u)
-            # print('nodes:', nodes)
-            unvisited = []
-            for node in nodes:
-                if node not in self._visited:
-                    unvisited.append(node)
-            # print('unvisited:', unvisited)
-            if unvisited:
-                # TODO: output something useful
-                return False
-            else:
-                return True
-
-        if not self.node[u]['run_conditions']:
-            self.node[u]['run_conditions'] = []
-        self.node[u]['run_conditions'].append(check)
+        self.add_run_condition(u, Visited(*nodes))
 
     def check_context_for(self, node, *args, **kwargs):
         """Add a run condition to `node` that checks whether keys `args` exist
         in the context and whether key-value pairs `kwargs` exist in the
         context
         """
-        def check():
-            missing = []
-            for arg in args:
-                if arg not in self._context:
-                    missing.append(arg)
-            
-            wrong_values = []
-            for k, v in kwargs.iteritems():
-                if k in self._context:
-                    match = v == self._context[k]
-                    if not match:
-                        wrong_values.append((k, v))
-                else:
-                    missing.append(k)
-
-            if missing or wrong_values:
-                # TODO: output something useful
-                return False
-            else:
-                return True
-
+        for arg in args:
+            self.add_run_condition(node, HasKey(arg))
+        for k, v in kwargs.iteritems():
+            self.add_run_condition(node, Equals(k, v))
+
+    def add_run_condition(self, node, condition):
+        """Add run condition `condition` to node `node`. Conditions from the
+        conditions module are compiled and only re-evaluated when the nodes
+        or context keys they look at change. Any other callable is called
+        without arguments every time the node is checked
+        """
         if not self.node[node]['run_conditions']:
             self.node[node]['run_conditions'] = []
-        self.node[node]['run_conditions'].append(check)
+        self.node[node]['run_conditions'].append(condition)
+        self._conditions.add(node, condition, self._visited, self._context)
+
+    def add_dynamic_event(self, node, event, p):
+        """When the story goes to `node`, go to node `event` instead with
+        probability `p`
+        """
+        node = str(node)
+        if not self.node[node]['dynamic_events']:
+            self.node[node]['dynamic_events'] = {}
+        self.node[node]['dynamic_events'][str(event)] = p
+        self._compiled = None
+
+    def remove_dynamic_event(self, node, event):
+        del self.node[str(node)]['dynamic_events'][str(event)]
+        self._compiled = None
 
     def add_edge(self, u, v, *args, **kwargs):
         """Given nodes u and v, add them to the graph if necessary and add an
         edge between them
         """
         super(Story, self).add_edge(str(u), str(v), *args, **kwargs)
+        self._compiled = None
 
     def add_edges_from(self, ebunch, *args, **kwargs):
-        """Given a list of edges `ebunch`, add them to the graph
+        """Given an iterable of edges `ebunch`, add them to the graph
         """
-        for i, edge in enumerate(ebunch):
+        edges = []
+        for edge in ebunch:
             edge = list(edge)
             edge[0], edge[1] = str(edge[0]), str(edge[1])
-            edge = tuple(edge)
-            ebunch[i] = edge
+            edges.append(tuple(edge))
+
+        super(Story, self).add_edges_from(edges, *args, **kwargs)
+        self._compiled = None
+
+    def remove_node(self, n):
+        super(Story, self).remove_node(n)
+        self._conditions.remove(n)
+        self._compiled = None
 
-        super(Story, self).add_edges_from(ebunch, *args, **kwargs)
+    def remove_nodes_from(self, nodes):
+        nodes = list(nodes)
+        super(Story, self).remove_nodes_from(nodes)
+        for n in nodes:
+            self._conditions.remove(n)
+        self._compiled = None
+
+    def remove_edge(self, u, v):
+        super(Story, self).remove_edge(u, v)
+        self._compiled = None
+
+    def clear(self):
+        super(Story, self).clear()
+        self._conditions = ConditionIndex()
+        self._compiled = None
+
+    def remove_edges_from(self, ebunch):
+        super(Story, self).remove_edges_from(ebunch)
+        self._compiled = None
 
     def add_undirected_edge(self, u, v, *args, **kwargs):
         self.add_edge(u, v, *args, **kwargs)
@@ -252,6 +550,7 @@ class Story(nx.DiGraph):
         # TODO: check for circular dependencies?
 
     def add_say(self, node, message, only_if=None):
+        template_fields(message) # parsed once up front
         self._add_action(node, 'say', message=message, only_if=only_if)
 
     def add_listen(self, node, intent, entity_type='', n_entities=0, 
@@ -299,7 +598,7 @@ class Story(nx.DiGraph):
             raise StoryError('That is not a valid action')
 
         action = {'type': kind, 'kwargs': kwargs}
-        if not self.node[node]['actions']:
+        if not self._actions(node):
             self.node[node]['actions'] = []
         self.node[node]['actions'].append(action)
 
@@ -314,43 +613,61 @@ class Story(nx.DiGraph):
         """
         if not self._current:
             return
-        elif not self.neighbors(self._current): # current is a leaf node
+        graph = self._get_compiled()
+        if graph.is_leaf(self._current):
+            self._wait_for_speech()
             self._is_finished = True
+            if self.journal:
+                self.journal.finish()
             return
 
+        grammar = self.grammar() if self.use_grammar else None
+        candidates = graph.successors(self._current)
         while True:
-            user_inp = self._input_fct() 
-            resp = parse(user_inp, self.workspace_id)
+            if self.stream_fct:
+                user_inp, resp = self._speculate(candidates, grammar)
+                if not resp:
+                    continue
+            else:
+                user_inp = self._get_input(grammar)
+                resp = self.parse_fct(user_inp, self.workspace_id, grammar)
             intent = get_intent(resp)
 
-            if intent in self.neighbors(self._current):
-                if self._is_runnable(intent): # will output something when False
-                    return self._select(intent)
+            node = graph.successor(self._current, intent)
+            if node:
+                if self._is_runnable(node): # will output something when False
+                    return self._select(node)
             elif intent:
                 msg = "Sorry I can't go to %s" % user_inp
-                self.output_fct(msg)
+                self._output(msg)
             else:
-                msg = "Sorry I didn't catch that. Could you repeat yourself?"
-                self.output_fct(msg)
+                self._output(REPEAT_MSG)
                     
+    def _speculate(self, candidates, grammar=None):
+        """Get input through the stream function, parsing interim
+        transcriptions while the user is still talking. Input stops as soon
+        as the intent settles on one of `candidates`
+
+        Returns: {tuple} The transcription and its parse response
+        """
+        spec = SpeculativeParser(self.workspace_id, candidates=candidates,
+                                 grammar=grammar, parse_fct=self.parse_fct)
+        kwargs = {}
+        if grammar:
+            kwargs['grammar'] = grammar
+        if self.barge_in:
+            kwargs['on_speech'] = self._interrupt
+        else:
+            self._wait_for_speech()
+        user_inp = self.stream_fct(on_partial=spec.feed,
+                                   should_stop=spec.is_stable, **kwargs)
+        return spec.commit(user_inp)
+
     def _select(self, node):
         """Selects a node to return based on the probability distrubtion
         given by `dynamic_events`
         """
-        dynamic_events = self.get_dynamic_events(node)
-        if dynamic_events:
-            d_items = zip(*dynamic_events.items())
-            nodes = list(d_items[0])
-            p_dist = list(d_items[1])
-            # add node to occupy leftover probability 
-            if sum(p_dist) < 1:
-                nodes.append(node)
-                p_dist.append(1. - sum(p_dist))
-            sample = list(multinomial(1, p_dist))
-            
-            return nodes[sample.index(1)]
-        else:
-            return node
+        return self._get_compiled().sample(node, self.random)
 
     def _run_current(self):
         """Run the current node
@@ -358,9 +675,17 @@ class Story(nx.DiGraph):
         if self._is_finished or not self._current:
             return 
 
-        if self.node[self._current]['actions']:
-            for action in self.node[self._current]['actions']:
-                self._do(action)
+        for action in self._actions(self._current) or []:
+            self._do(action)
+
+    def _actions(self, n):
+        """Returns the actions of node `n`, decoding them first if they were
+        loaded lazily (see story_format.LazyActions)
+        """
+        actions = self.node[n]['actions']
+        if hasattr(actions, 'materialize'):
+            actions = self.node[n]['actions'] = actions.materialize()
+        return actions
 
     def _do(self, action):
         """
@@ -379,19 +704,11 @@ class Story(nx.DiGraph):
         """
         if only_if and not self._check_only_if(*only_if):
             return
-        context_copy = self._context.copy()
-        for k, v in context_copy.iteritems():
-            if type(v) is list and len(v) > 0:
-                if type(v[0]) is str:
-                    context_copy[k] = englishify(v)
-                elif v[0] == 0:
-                    context_copy[k] = englishify(v[1:])
-                elif v[0] == 1:
-                    context_copy[k] = englishify(v[1:], conj=False)
-                else:
-                    raise StoryError('Unknown option %s' % v[0])
-                
-        self._output_fct(message.format(**context_copy))
+        context = self.format_context(template_fields(message))
+        if self.template_fct:
+            self._track(self.template_fct(message, context))
+        else:
+            self._output(message.format(**context))
 
     def _listen(self, intent, entity_type='', n_entities=0, verify_with='', 
             context_key='', fail_message='', only_if=None):
@@ -400,14 +717,13 @@ class Story(nx.DiGraph):
         if only_if and not self._check_only_if(*only_if):
             return
         assert self.workspace_id, 'No valid workspace ID'
+        grammar = self.grammar(intent, verify_with) if self.use_grammar else None
         while True:
             # transcribe audio and parse it
-            inp = self._input_fct()
-            resp = parse(inp, self.workspace_id)
+            inp = self._get_input(grammar)
+            resp = self.parse_fct(inp, self.workspace_id, grammar)
             if get_intent(resp) != intent.strip():
-                error_msg = "Sorry, I didn't understand what you said. " +\
-                        "Could you try rephrasing?"
-                self._output_fct(error_msg)
+                self._output(REPHRASE_MSG)
                 continue # mismatching intent so start over
             
             entities = get_entities(resp)
@@ -428,20 +744,18 @@ class Story(nx.DiGraph):
                             break
                     if has_invalid_entities:
                         # print('has invalid entities')
-                        default_msg = "I didn't recognize something you said. " +\
-                                "Could you repeat yourself?"
-                        msg = fail_message if fail_message else default_msg
-                        self._output_fct(msg)
+                        msg = fail_message if fail_message else UNRECOGNIZED_MSG
+                        self._output(msg)
                         continue
                 if len(entities) == 0:
                     # print('entites has len 0')
                     pass
                 elif len(entities) == 1:
                     # print('context updated')
-                    self._context[context_key] = entities[0]
+                    self.update_context({context_key: entities[0]})
                 else:
                     # print('context updated')
-                    self._context[context_key] = entities
+                    self.update_context({context_key: entities})
             return # none of the continues were hit
 
     def _play(self, source, only_if=None):
@@ -454,7 +768,67 @@ class Story(nx.DiGraph):
         """
         if only_if and not self._check_only_if(*only_if):
             return
-        webbrowser.open(source, new=2)
+        self._wait_for_speech()
+        self.play_fct(source)
+
+    def _output(self, message):
+        """Output `message`, keeping track of it if it is still playing
+        """
+        self._track(self._output_fct(message))
+
+    def _track(self, handle):
+        if hasattr(handle, 'wait'):
+            self._speaking = [h for h in self._speaking if not h.done()]
+            self._speaking.append(handle)
+
+    def _wait_for_speech(self):
+        """Block until every message has finished playing
+        """
+        speaking, self._speaking = self._speaking, []
+        for handle in speaking:
+            handle.wait()
+
+    def _interrupt(self):
+        """Stop the messages that are still playing, e.g. when the user
+        starts talking over them
+        """
+        speaking, self._speaking = self._speaking, []
+        for handle in speaking:
+            handle.cancel()
+
+    def _get_input(self, grammar=None):
+        """Get input from the user. With barge-in the user may start talking
+        before speech has finished, which cuts the speech short
+        """
+        kwargs = {}
+        if grammar:
+            kwargs['grammar'] = grammar
+        if self.barge_in:
+            return self._input_fct(on_speech=self._interrupt, **kwargs)
+        self._wait_for_speech()
+        return self._input_fct(**kwargs)
+
+    def _format_value(self, k):
+        """Returns the context value of key `k` as a say action renders it.
+        Lists are turned into English once and the result is reused until
+        the context is set again
+        """
+        v = self._context[k]
+        if type(v) is not list or len(v) == 0:
+            return v
+        cached = self._formatted.get(k)
+        if cached and cached[0] == self._context_version:
+            return cached[1]
+        if isinstance(v[0], basestring):
+            formatted = englishify(v)
+        elif v[0] == 0:
+            formatted = englishify(v[1:])
+        elif v[0] == 1:
+            formatted = englishify(v[1:], conj=False)
+        else:
+            raise StoryError('Unknown option %s' % v[0])
+        self._formatted[k] = (self._context_version, formatted)
+        return formatted
 
     def _check_only_if(self, k, v):
         if self._context[k] == v:
@@ -465,15 +839,10 @@ class Story(nx.DiGraph):
     def _is_runnable(self, n):
         """Checks whether the run conditions are satisifed for node `n` 
         """
-        return self._check_conditions(self.get_run_conditions(n))
+        return self._conditions.is_runnable(n)
 
-    def _check_conditions(self, l):
-        """Helper for is_runnable
-        """
-        if not l:
-            return True 
-        elif len(l) == 1:
-            return l[0]()
-        else:
-            return l[0]() and self._check_conditions(l[1:])
+    def _get_compiled(self):
+        if self._compiled is None:
+            self.compile()
+        return self._compiled
     
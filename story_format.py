@@ -0,0 +1,172 @@
+"""Saving and loading stories. A story file is JSON lines, one record per
+line, so files are streamed when loaded and diff cleanly:
+
+    {"format": "lily-story", "version": 1, "workspace_id": ..., "start": ...,
+     "context": {...}}
+    {"node": "box_office", "dynamic_events": {"wallet": 0.01},
+     "run_conditions": [{"visited": ["movie_greeting"]},
+                        {"has_key": "name"},
+                        {"equals": ["movie_choice", "minions"]}]}
+    {"actions": "box_office", "list": [{"type": "say", "kwargs": {...}}]}
+    {"edge": ["movie_greeting", "box_office"]}
+
+The header comes first. Every node has a node line, and the nodes with
+actions an actions line after it. Edges with attributes carry them in
+"data". Action lists are only decoded the first time a node's actions are
+needed, so large stories open quickly. Tuples in actions, e.g. only_if, come
+back as lists.
+
+A story file holds what the story is, not how far it has been run. "start"
+is the node that was current when the story was saved, and the loaded story
+starts there with only that node visited. The visited nodes aren't saved,
+see story_journal for resuming a run.
+"""
+import json
+import os
+
+from conditions import Visited, HasKey, Equals
+from story import Story
+
+FORMAT = 'lily-story'
+FORMAT_VERSION = 1
+
+_ACTIONS_PREFIX = '{"actions": '
+
+class StoryFormatError(Exception):
+    pass
+
+class LazyActions(object):
+    """The action list of a node as it is in the file. Story decodes it the
+    first time the actions are needed
+    """
+
+    def __init__(self, line):
+        self.line = line
+
+    def materialize(self):
+        return json.loads(self.line)['list']
+
+def dump(story, f):
+    """Write `story` to the file object `f`. Its current node is saved as the
+    start, its visited nodes aren't saved
+    """
+    header = {'format': FORMAT,
+              'version': FORMAT_VERSION,
+              'workspace_id': story.workspace_id,
+              'start': story.current,
+              'context': story.context}
+    _write(f, header)
+    for n in sorted(story.nodes()):
+        attrs = story.node[n]
+        _write(f, {'node': n,
+                   'dynamic_events': attrs.get('dynamic_events') or {},
+                   'run_conditions': [_dump_condition(n, c) for c in
+                                      attrs.get('run_conditions') or []]})
+        actions = attrs.get('actions')
+        if isinstance(actions, LazyActions): # unchanged since it was loaded
+            f.write(actions.line.rstrip('\n') + '\n')
+        elif actions:
+            # the node name comes first so load can find it without decoding
+            # the list
+            f.write(_ACTIONS_PREFIX + json.dumps(n) + ', "list": ' +
+                    json.dumps(actions, sort_keys=True) + '}\n')
+    for u, v, data in sorted(story.edges(data=True)):
+        record = {'edge': [u, v]}
+        if data:
+            record['data'] = data
+        _write(f, record)
+
+def load(f, story=None):
+    """Read a story from the file object `f`
+
+    Parameters:
+    f {file} The file to read from
+    story {Story} Optional. The story the nodes and edges are added to, e.g.
+                  one with input and output functions set. Defaults to a
+                  new Story
+
+    Returns: {Story} The story
+    """
+    header = _read(next(iter(f), ''))
+    if header.get('format') != FORMAT:
+        raise StoryFormatError('Not a story file')
+    if header.get('version', 0) > FORMAT_VERSION:
+        raise StoryFormatError('Story file version %s is newer than %s' %
+                               (header.get('version'), FORMAT_VERSION))
+    if story is None:
+        story = Story(workspace_id=header.get('workspace_id'))
+    elif header.get('workspace_id'):
+        story.workspace_id = header['workspace_id']
+
+    for line in f:
+        if not line.strip():
+            continue
+        if line.startswith(_ACTIONS_PREFIX):
+            n, _ = json.JSONDecoder().raw_decode(line, len(_ACTIONS_PREFIX))
+            story.node[n]['actions'] = LazyActions(line)
+            continue
+        record = _read(line)
+        if 'node' in record:
+            n = record['node']
+            story.add_node(n)
+            for event, p in record.get('dynamic_events', {}).iteritems():
+                story.add_dynamic_event(n, event, p)
+            for c in record.get('run_conditions', []):
+                story.add_run_condition(n, _load_condition(c))
+        elif 'actions' in record: # an actions line that was edited by hand
+            story.node[record['actions']]['actions'] = record['list']
+        elif 'edge' in record:
+            u, v = record['edge']
+            story.add_edge(u, v, **record.get('data', {}))
+        else:
+            raise StoryFormatError('Unknown record %s' % line.strip())
+
+    story.update_context(header.get('context', {}))
+    if header.get('start'):
+        story.current = header['start']
+    return story
+
+def save(story, path):
+    """Write `story` to the file at `path`
+    """
+    # write to a temporary file first so a crash never leaves a truncated
+    # story behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        dump(story, f)
+    if os.path.exists(path):
+        os.remove(path) # os.rename doesn't overwrite on Windows
+    os.rename(tmp_path, path)
+
+def open_story(path, story=None):
+    """Read the story in the file at `path`, see load
+    """
+    with open(path) as f:
+        return load(f, story)
+
+def _write(f, record):
+    f.write(json.dumps(record, sort_keys=True) + '\n')
+
+def _read(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise StoryFormatError('Malformed line %r: %s' % (line[:80], e))
+
+def _dump_condition(n, c):
+    if isinstance(c, Visited):
+        return {'visited': list(c.nodes)}
+    elif isinstance(c, HasKey):
+        return {'has_key': c.key}
+    elif isinstance(c, Equals):
+        return {'equals': [c.key, c.value]}
+    raise StoryFormatError('The run condition %r of %s cannot be saved' % (c, n))
+
+def _load_condition(c):
+    if 'visited' in c:
+        return Visited(*c['visited'])
+    elif 'has_key' in c:
+        return HasKey(c['has_key'])
+    elif 'equals' in c:
+        return Equals(*c['equals'])
+    raise StoryFormatError('Unknown run condition %s' % c)
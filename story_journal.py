@@ -0,0 +1,230 @@
+"""An append-only journal of the progress through a story, so a story can be
+resumed where it was if the process dies. Every node entered and every
+context update is a JSON line, and every `checkpoint_every` records the
+full state is written too, so resuming only replays the records after the
+last checkpoint, which is found by reading the file backwards. The journal
+holds every session in order and doubles as a log for analytics.
+
+    {"session": "...", "t": 1476800000.0, "type": "start"}
+    {"session": "...", "t": ..., "type": "enter", "node": "box_office"}
+    {"session": "...", "t": ..., "type": "context", "update": {...}}
+    {"session": "...", "t": ..., "type": "checkpoint", "current": ...,
+     "visited": [...], "context": {...}}
+    {"session": "...", "t": ..., "type": "finish"}
+"""
+import json
+import os
+import time
+import uuid
+
+from threading import Lock, Timer
+
+class StoryJournal(object):
+    """Records the progress through a story. Each record is flushed to the OS
+    as soon as it is written, so nothing is lost if the process crashes.
+    Syncing to disk, which only matters if the machine goes down, is batched
+    """
+
+    def __init__(self, path, checkpoint_every=32, fsync_every=16,
+            fsync_interval=1.):
+        """Constructor for StoryJournal
+
+        Parameters:
+        path {str} The journal file. Created if it doesn't exist
+        checkpoint_every {int} The number of records between checkpoints
+        fsync_every {int} The number of records written before syncing
+        fsync_interval {float} The number of seconds after which records are
+                               synced even if there are fewer. A timer syncs
+                               them if nothing else is written
+        """
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.session = None
+        self.story = None
+        self._f = None
+        self._n_since_checkpoint = 0
+        self._n_unsynced = 0
+        self._last_sync = time.time()
+        self._lock = Lock() # the sync timer runs on another thread
+        self._timer = None
+
+    def recover(self):
+        """Returns the state of the last session if it didn't finish, as a
+        dict with `session`, `current`, `visited` and `context`, or None
+        """
+        records = _tail(self.path)
+        if not records or records[-1]['type'] == 'finish':
+            return None
+        session = records[-1]['session']
+        state = {'session': session, 'current': None, 'visited': [],
+                 'context': {}}
+        for record in records:
+            if record['session'] != session:
+                continue
+            kind = record['type']
+            if kind == 'checkpoint':
+                state['current'] = record['current']
+                state['visited'] = list(record['visited'])
+                state['context'] = dict(record['context'])
+            elif kind == 'enter':
+                state['current'] = record['node']
+                if record['node'] not in state['visited']:
+                    state['visited'].append(record['node'])
+            elif kind == 'context':
+                state['context'].update(record['update'])
+            elif kind == 'start':
+                state['context'] = {}
+        if state['current'] is None:
+            return None
+        return state
+
+    def attach(self, story, state=None):
+        """Start journaling `story`. If `state` from recover is given, the
+        story is restored to it and its session continues. Otherwise a new
+        session starts
+        """
+        self.story = story
+        if self._f is None:
+            self._f = open(self.path, 'a+')
+            self._f.seek(0, os.SEEK_END)
+            if self._f.tell():
+                self._f.seek(-1, os.SEEK_END)
+                if self._f.read(1) != '\n': # end the line torn by a crash
+                    self._f.seek(0, os.SEEK_END)
+                    self._f.write('\n')
+        if state:
+            story.restore(state['current'], state['visited'],
+                          state['context'])
+            self.session = state['session']
+        else:
+            self.session = uuid.uuid4().hex
+            self._write({'type': 'start'})
+        story.journal = self
+        self.checkpoint()
+
+    def enter(self, node):
+        """Record that the story entered `node`
+        """
+        self._write({'type': 'enter', 'node': node})
+
+    def update(self, d):
+        """Record that the keys and values in dict `d` were set in the context
+        """
+        self._write({'type': 'context', 'update': d})
+
+    def finish(self):
+        """Record that the story finished, so it won't be resumed
+        """
+        self._write({'type': 'finish'})
+        self.sync()
+
+    def checkpoint(self):
+        """Record the full state of the story
+        """
+        s = self.story
+        self._write({'type': 'checkpoint', 'current': s.current,
+                     'visited': sorted(s.visited), 'context': s.context})
+        self._n_since_checkpoint = 0
+
+    def sync(self):
+        """Make sure everything written so far is on disk
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._f is not None and self._n_unsynced:
+                os.fsync(self._f.fileno())
+                self._n_unsynced = 0
+            self._last_sync = time.time()
+
+    def close(self):
+        if self._f is not None:
+            self.sync()
+            with self._lock:
+                self._f.close()
+                self._f = None
+        if self.story is not None and self.story.journal is self:
+            self.story.journal = None
+
+    def _write(self, record):
+        record['session'] = self.session
+        record['t'] = time.time()
+        with self._lock:
+            self._f.write(json.dumps(record, sort_keys=True) + '\n')
+            self._f.flush()
+            self._n_unsynced += 1
+            due = self._n_unsynced >= self.fsync_every or \
+                record['t'] - self._last_sync >= self.fsync_interval
+            if not due and self._timer is None:
+                self._timer = Timer(self.fsync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.sync()
+        if record['type'] != 'checkpoint':
+            self._n_since_checkpoint += 1
+            if self._n_since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+def iter_records(path):
+    """Yield every record in the journal at `path`, e.g. for analytics
+    """
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError: # blank or torn by a crash
+                continue
+
+def _tail(path, block_size=1 << 16):
+    """Returns the records of the journal at `path` from its last checkpoint
+    on, reading the file backwards. A torn last line is skipped
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return []
+    with f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        end = None # the candidates from here on aren't checkpoints
+        found = False
+        while pos > 0 and not found:
+            n = min(block_size, pos)
+            pos -= n
+            f.seek(pos)
+            data = f.read(n) + data
+            if end is not None:
+                end += n
+            while True:
+                i = data.rfind(b'"type": "checkpoint"', 0, end)
+                if i == -1:
+                    break
+                start = data.rfind(b'\n', 0, i) + 1
+                if not start and pos > 0:
+                    break # the line starts in the previous block
+                stop = data.find(b'\n', i)
+                # the text may also be a key nested in the context
+                if _is_checkpoint(data[start:stop if stop != -1 else None]):
+                    data = data[start:]
+                    found = True
+                    break
+                end = start
+    records = []
+    for line in data.splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError: # the last write was cut short
+            continue
+    return records
+
+def _is_checkpoint(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return False
+    return isinstance(record, dict) and record.get('type') == 'checkpoint'
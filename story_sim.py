@@ -0,0 +1,226 @@
+"""A headless Monte-Carlo simulator for stories. Playthroughs are driven by a
+random (or partly scripted) user that only ever says something the story
+can handle at that point, and parsing is bypassed by an oracle that reads
+the intent straight off the input, so no speech, network or NLU is involved.
+Playthroughs are spread over a process pool and summarized in a report,
+e.g. to tune the probabilities of dynamic events. The story is a story
+module or a module:function factory, see story.load_factory
+
+    python story_sim.py movie 100000
+    python story_sim.py zoo
+"""
+from __future__ import print_function
+
+import multiprocessing
+import random
+import sys
+import warnings
+
+from collections import Counter
+
+import networkx as nx
+
+class DeadEnd(Exception):
+    pass
+
+class SimulatedUser(object):
+    """Stands in for the input function of a Story created with
+    use_grammar, answering with an intent from the grammar it is passed.
+    Answers are encoded as "intent" or "intent: entity, entity" for
+    oracle_parse
+    """
+
+    def __init__(self, rng, script=None, max_tries=20):
+        """Constructor for SimulatedUser
+
+        Parameters:
+        rng {random.Random} The random number generator answers are picked
+                            with
+        script {list} Optional. Answers given before answering randomly
+        max_tries {int} The number of answers in a row after which a story
+                        that keeps asking is considered stuck
+        """
+        self.rng = rng
+        self.script = list(script or [])
+        self.max_tries = max_tries
+        self.n_tries = 0
+
+    def __call__(self, grammar=None):
+        self.n_tries += 1
+        if self.n_tries > self.max_tries:
+            raise DeadEnd()
+        if self.script:
+            return self.script.pop(0)
+        if not grammar or not grammar['intents']:
+            raise DeadEnd()
+        answer = self.rng.choice(grammar['intents'])
+        if grammar['entities']:
+            answer += ': ' + self.rng.choice(grammar['entities'])
+        return answer
+
+def oracle_parse(s, workspace_id=None, grammar=None):
+    """Parse an answer of SimulatedUser into a response with full confidence
+    """
+    intent, _, entities = s.partition(':')
+    return {'input': {'text': s},
+            'intents': [{'intent': intent.strip(), 'confidence': 1.}],
+            'entities': [{'entity': '', 'value': e.strip()}
+                         for e in entities.split(',') if e.strip()]}
+
+def playthrough(s, rng, script=None, max_steps=100):
+    """Play story `s` once. The story's functions are replaced with the
+    simulated user and the oracle, and nothing is output
+
+    Parameters:
+    s {Story} A new story, set at its first node
+    rng {random.Random} The random number generator for the user and the
+                        story
+    script {list} Optional. See SimulatedUser
+    max_steps {int} The number of nodes after which the playthrough is cut
+                    short
+
+    Returns: {tuple} The nodes in the order they were entered and how the
+             playthrough ended: 'finished', 'dead end' or 'cut short'
+    """
+    user = SimulatedUser(rng, script)
+    s.input_fct = user
+    s.output_fct = lambda message: None
+    s.play_fct = lambda url: None
+    s.parse_fct = oracle_parse
+    s.stream_fct = None
+    s.template_fct = None
+    s.barge_in = False
+    s.use_grammar = True
+    s.random = rng
+
+    path = [s.current]
+    while not s.is_finished:
+        if len(path) > max_steps:
+            return path, 'cut short'
+        user.n_tries = 0
+        try:
+            s()
+        except DeadEnd:
+            return path, 'dead end'
+        if not s.is_finished:
+            path.append(s.current)
+    return path, 'finished'
+
+def _simulate_chunk(args):
+    factory, n, seed, max_steps = args
+    # factories may sample from the random module themselves
+    random.seed(seed)
+    rng = random.Random(seed)
+    visits = Counter()
+    lengths = Counter()
+    dead_ends = Counter()
+    endings = Counter()
+    nodes = set()
+    unreachable = set()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for _ in xrange(n):
+            s = factory()
+            nodes.update(s.nodes())
+            if s.current:
+                reachable = nx.descendants(s, s.current)
+                reachable.add(s.current)
+                unreachable.update(set(s.nodes()) - reachable)
+            path, ending = playthrough(s, rng, max_steps=max_steps)
+            visits.update(set(path))
+            lengths[len(path)] += 1
+            endings[ending] += 1
+            if ending == 'dead end':
+                dead_ends[path[-1]] += 1
+    return visits, lengths, dead_ends, endings, nodes, unreachable
+
+def simulate(factory, n, processes=None, seed=0, max_steps=100, chunk_size=1000):
+    """Run `n` playthroughs of the story made by `factory` across a process
+    pool
+
+    Parameters:
+    factory {callable} Returns a new Story, set at its first node. Must be
+                       picklable, e.g. a module level function or a
+                       functools.partial of one
+    n {int} The number of playthroughs
+    processes {int} The number of worker processes. Defaults to the number
+                    of CPUs
+    seed {int} Seeds the playthroughs, so a simulation can be reproduced
+    max_steps {int} See playthrough
+    chunk_size {int} The number of playthroughs handed to a worker at a time
+
+    Returns: {dict} The report, see format_report
+    """
+    chunks = []
+    for i, start in enumerate(xrange(0, n, chunk_size)):
+        chunks.append((factory, min(chunk_size, n - start), seed + i,
+                       max_steps))
+    if processes == 1:
+        results = map(_simulate_chunk, chunks)
+    else:
+        p = multiprocessing.Pool(processes)
+        try:
+            results = p.map(_simulate_chunk, chunks)
+        finally:
+            p.close()
+            p.join()
+
+    visits = Counter()
+    lengths = Counter()
+    dead_ends = Counter()
+    endings = Counter()
+    nodes = set()
+    unreachable = set()
+    for chunk_visits, chunk_lengths, chunk_dead_ends, chunk_endings, \
+            chunk_nodes, chunk_unreachable in results:
+        visits.update(chunk_visits)
+        lengths.update(chunk_lengths)
+        dead_ends.update(chunk_dead_ends)
+        endings.update(chunk_endings)
+        nodes.update(chunk_nodes)
+        unreachable.update(chunk_unreachable)
+
+    return {'n': n,
+            'visits': dict((node, visits[node] / float(n)) for node in nodes),
+            'lengths': dict(lengths),
+            'endings': dict(endings),
+            'dead_ends': dict(dead_ends),
+            'unreachable': sorted(unreachable),
+            'never_visited': sorted(nodes - set(visits))}
+
+def format_report(report):
+    """Returns `report` as text. The report has the number of playthroughs
+    `n`, the fraction of playthroughs that `visits` each node, the
+    distribution of path `lengths`, how many playthroughs each of the
+    `endings` had, the nodes that are `dead_ends`, the nodes that are
+    `unreachable` from the first node in some story made by the factory
+    and the nodes that were `never_visited`
+    """
+    n = float(report['n'])
+    lines = ['%d playthroughs' % report['n'], '', 'visits:']
+    for node, p in sorted(report['visits'].items(), key=lambda i: -i[1]):
+        lines.append('  %-24s %6.2f%%' % (node, 100 * p))
+    lines += ['', 'path lengths:']
+    for length, count in sorted(report['lengths'].items()):
+        lines.append('  %-24d %6.2f%%' % (length, 100 * count / n))
+    lines += ['', 'endings:']
+    for ending, count in sorted(report['endings'].items()):
+        lines.append('  %-24s %6.2f%%' % (ending, 100 * count / n))
+    if report['dead_ends']:
+        lines += ['', 'dead ends:']
+        for node, count in sorted(report['dead_ends'].items(),
+                                  key=lambda i: -i[1]):
+            lines.append('  %-24s %6.2f%%' % (node, 100 * count / n))
+    lines += ['', 'unreachable: %s' % (', '.join(report['unreachable']) or '-'),
+              'never visited: %s' % (', '.join(report['never_visited']) or '-')]
+    return '\n'.join(lines)
+
+def main():
+    from story import load_factory
+
+    name = sys.argv[1] if len(sys.argv) > 1 else 'movie'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    print(format_report(simulate(load_factory(name), n)))
+
+if __name__ == '__main__':
+    main()
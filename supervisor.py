@@ -0,0 +1,162 @@
+"""Starts, watches and stops the child processes of LilyMasterControl. Each
+child sends READY once it has started up and a HEARTBEAT a few times a
+second after that. A child that exits, or goes quiet for longer than the
+heartbeat timeout, is killed and started again, unless it sent EXIT to say
+it is done. Restarts back off
+exponentially while a child keeps crashing. Children are started in the
+order they were added and stopped in the reverse order.
+"""
+import sys
+import time
+
+import IPC
+import messages
+
+class _Child(object):
+
+    def __init__(self, proc, on_read, on_ready):
+        self.proc = proc
+        self.on_read = on_read
+        self.on_ready = on_ready
+        self.ready = False
+        self.finished = False # sent EXIT, so it isn't restarted
+        self.started_at = None
+        self.last_seen = None
+        self.restart_at = None # when a crashed child is started again
+        self.backoff = None
+        self.restarts = 0
+
+class Supervisor(object):
+    """The child processes, which report through `dispatcher`. check must be
+    called regularly, e.g. from the main loop
+    """
+
+    def __init__(self, dispatcher, heartbeat_timeout=.6, startup_timeout=30.,
+            min_backoff=.1, max_backoff=5., stable_after=10.):
+        """Constructor for Supervisor
+
+        Parameters:
+        dispatcher {IPC.Dispatcher} The dispatcher children report through
+        heartbeat_timeout {float} The number of seconds without a message
+                                  after which a ready child is restarted.
+                                  Children send heartbeats every .25 seconds
+        startup_timeout {float} The number of seconds a child has to become
+                                ready before it is restarted
+        min_backoff {float} The number of seconds before the first restart
+        max_backoff {float} The most seconds between restarts
+        stable_after {float} The number of seconds a child has to run for
+                             its backoff to be reset
+        """
+        self.dispatcher = dispatcher
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.children = []
+
+    def add(self, script, on_read, on_ready=None):
+        """Add a child. It is started by start
+
+        Parameters:
+        script {str} The Python script of the child
+        on_read {callable} Called with no arguments for every message of the
+                           child except heartbeats, see IPC.process
+        on_ready {callable} Optional. Called with no arguments whenever the
+                            child becomes ready, including after a restart
+
+        Returns: {IPC.process} The child
+        """
+        proc = IPC.process(False, script, self.dispatcher, framed=True,
+                           start=False)
+        child = _Child(proc, on_read, on_ready)
+        proc.setOnReadLine(lambda: self._receive(child))
+        self.children.append(child)
+        return proc
+
+    def start(self):
+        """Start every child that was added, in order
+        """
+        for child in self.children:
+            if child.started_at is None:
+                child.backoff = self.min_backoff
+                self._spawn(child)
+
+    def wait_ready(self, timeout=None):
+        """Handle messages until every child is ready
+
+        Returns: {bool} Whether every child became ready, or exited on
+                 purpose, within `timeout` seconds
+        """
+        end = None if timeout is None else time.time() + timeout
+        while not all(child.ready or child.finished
+                      for child in self.children):
+            self.check()
+            if end is not None and time.time() >= end:
+                return False
+            self.dispatcher.wait(0.1)
+        return True
+
+    def check(self):
+        """Restart the children that died or stopped sending heartbeats,
+        except the ones that sent EXIT
+        """
+        now = time.time()
+        for child in self.children:
+            if child.started_at is None or child.finished:
+                continue
+            if child.restart_at is not None:
+                if now >= child.restart_at:
+                    self._spawn(child)
+                continue
+            if not child.proc.isAlive():
+                problem = 'exited'
+            elif child.ready and \
+                    now - child.last_seen > self.heartbeat_timeout:
+                problem = 'stopped responding'
+            elif not child.ready and \
+                    now - child.started_at > self.startup_timeout:
+                problem = "didn't start up"
+            else:
+                continue
+            child.proc.stop(0)
+            if now - child.started_at > self.stable_after:
+                child.backoff = self.min_backoff
+            child.restart_at = now + child.backoff
+            sys.stderr.write('%s %s, restarting it in %.1fs\n' %
+                             (child.proc.var, problem, child.backoff))
+            child.backoff = min(2 * child.backoff, self.max_backoff)
+
+    def stop(self, timeout=.5):
+        """Stop every child, in the reverse order they were started
+
+        Parameters:
+        timeout {float} The number of seconds each child has to exit after
+                        its input is closed before it is killed
+        """
+        for child in reversed(self.children):
+            child.proc.stop(timeout)
+            child.started_at = child.restart_at = None
+            child.ready = False
+
+    def _spawn(self, child):
+        if child.restart_at is not None:
+            child.restarts += 1
+        child.ready = child.finished = False
+        child.restart_at = None
+        child.started_at = child.last_seen = time.time()
+        child.proc.start()
+
+    def _receive(self, child):
+        child.last_seen = time.time()
+        kind = child.proc.message.type
+        if kind == messages.HEARTBEAT:
+            return
+        if kind == messages.EXIT:
+            child.finished = True
+            return
+        if kind == messages.READY and not child.ready:
+            child.ready = True
+            if child.on_ready is not None:
+                child.on_ready()
+        child.on_read()
@@ -1,20 +1,27 @@
-import pyaudio
+import numpy as np
+import string
+import struct
 import wave
-import time
 
 from StringIO import StringIO
+from threading import Thread
 from watson_developer_cloud import TextToSpeechV1
-from timeout import timeout_decorate, TimeoutError
+from timeout import pool, call_with_deadline, retry, TimeoutError
+from audio_output import AudioOutput
+from tts_cache import AudioCache, is_speakable
+from ring_buffer import RingBuffer
 from pymouse import PyMouse
 
 # define enter/exit methods for use in a context manager
 StringIO.__enter__ = lambda self: self
 StringIO.__exit__ = lambda self, e_type, e_val, tb: self.close()
 
-TextToSpeechV1.synthesize = timeout_decorate(TextToSpeechV1.synthesize, seconds=5)
 tts = TextToSpeechV1(username='68819f91-e8a5-49e3-b284-3b66ed470bb9',
                      password='1tkAyaLoSdhm')
-wf = None # the wave file
+VOICE = 'en-US_AllisonVoice'
+cache = AudioCache()
+pcm_cache = AudioCache(ext='.pcm')
+_PCM_HEADER = '<III' # rate, sample width, channels
 
 m = PyMouse()
 def click():
@@ -26,45 +33,262 @@ def click():
 class SpeechError(Exception):
     pass
 
-def callback(in_data, frame_count, time_info, status):
-    """pyaudio callback
-    """
-    data = wf.readframes(frame_count)
-    return data, pyaudio.paContinue
+# one output stream is kept open for every utterance, and the avatar is
+# clicked when speech starts and when the queue runs dry
+output = AudioOutput(on_start=click, on_idle=click)
 
-def speak(s):
-    """Do TTS on a string `s`
+def synthesize(s, voice=VOICE):
+    """Get the WAV audio of `s` spoken by `voice`, from the cache if it was
+    synthesized before
     """
-    global wf
-    
-    audio = None
-    for i in range(3):
-        try:
-            audio = tts.synthesize(s, accept='audio/wav', voice='en-US_AllisonVoice')
-        except TimeoutError:
-            print('Timemout %d occured' % i)
-        else:
-            break
+    audio = cache.get(voice, s)
+    if audio:
+        return audio
+
+    def on_timeout(i):
+        print('Timemout %d occured' % i)
+
+    try:
+        audio = retry(tts.synthesize, args=(s,),
+                      kwargs={'accept': 'audio/wav', 'voice': voice},
+                      attempts=3, seconds=5, on_timeout=on_timeout)
+    except TimeoutError:
+        pass
     if not audio:
         raise SpeechError('No response received')
+    cache.put(voice, s, audio)
+    return audio
+
+def synthesize_pcm(s, voice=VOICE):
+    """Get the audio of `s` spoken by `voice` as raw PCM, from the PCM cache
+    if it was synthesized before
+
+    Returns: {tuple} The (rate, sample width, channels) of the audio and the
+             PCM data
+    """
+    data = pcm_cache.get(voice, s)
+    if data:
+        return struct.unpack_from(_PCM_HEADER, data), \
+               data[struct.calcsize(_PCM_HEADER):]
+    params, pcm = _decode(synthesize(s, voice))
+    pcm_cache.put(voice, s, struct.pack(_PCM_HEADER, *params) + pcm)
+    return params, pcm
+
+def speak(s, voice=VOICE):
+    """Do TTS on a string `s` and wait until it has been spoken
+    """
+    speak_async(s, voice).wait()
+
+def speak_async(s, voice=VOICE):
+    """Queue TTS of a string `s` and return immediately. Audio that isn't
+    cached is played while it is still being downloaded
+
+    Returns: {PlaybackHandle} A handle to wait on or cancel the speech
+    """
+    audio = cache.get(voice, s)
+    if audio:
+        params, pcm = _decode(audio)
+        return output.play((params, StringIO(pcm).read))
+    return output.play(pool.submit(_stream_audio, s, voice))
+
+def speak_template(template, context, voice=VOICE):
+    """Do TTS on the format string `template` filled in from `context` and
+    wait until it has been spoken
+    """
+    speak_template_async(template, context, voice).wait()
+
+def speak_template_async(template, context, voice=VOICE):
+    """Queue TTS of the format string `template` filled in from `context`
+    without synthesizing it as a whole. The text between replacement fields
+    and the value of each field are synthesized (or fetched from the PCM
+    cache) separately and joined with short crossfades, so a template only
+    needs the network for slot values that were never heard before
+
+    Returns: {PlaybackHandle} A handle to wait on or cancel the speech
+    """
+    return output.play(pool.submit(_stitch, template, context, voice))
 
+def _stitch(template, context, voice):
+    """Returns the format and a reader of the stitched audio of `template`
+    """
+    pieces = []
+    for text in template_pieces(template, context):
+        params, pcm = synthesize_pcm(text, voice)
+        if pieces and params != pieces[0][0]:
+            raise SpeechError('Fragments have different audio formats')
+        pieces.append((params, pcm))
+    if not pieces:
+        return (22050, 2, 1), StringIO(b'').read
+    params = pieces[0][0]
+    pcm = _crossfade([pcm for _, pcm in pieces], *params)
+    return params, StringIO(pcm).read
+
+def template_pieces(template, context):
+    """Split `template` into the literal text between its replacement fields
+    and the formatted value of each field. Pieces with nothing to say are
+    dropped
+    """
+    formatter = string.Formatter()
+    pieces = []
+    for literal, field, spec, conversion in formatter.parse(template):
+        pieces.append(literal)
+        if field is not None:
+            value, _ = formatter.get_field(field, (), context)
+            value = formatter.convert_field(value, conversion)
+            pieces.append(formatter.format_field(value, spec))
+    return [piece.strip() for piece in pieces if is_speakable(piece)]
+
+def _stream_audio(s, voice, prebuffer=0.1, deadline=5, stall=5):
+    """Start synthesizing `s` and return as soon as `prebuffer` seconds of
+    audio have arrived. The rest of the download fills a ring buffer that
+    playback drains. The complete audio is cached afterwards. SpeechError is
+    raised if the WAV header hasn't arrived within `deadline` seconds, and
+    the utterance is cut short if playback runs out of audio and nothing
+    arrives for `stall` seconds
+
+    Returns: {tuple} The (rate, sample width, channels) of the audio and a
+             reader of the ring buffer
+    """
+    def on_timeout(i):
+        print('Timemout %d occured' % i)
+
+    try:
+        response = retry(_open_stream, args=(s, voice), attempts=3, seconds=5,
+                         on_timeout=on_timeout)
+    except TimeoutError:
+        raise SpeechError('No response received')
+
+    chunks = response.iter_content(chunk_size=4096)
+
+    def read_header():
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            header = _parse_wav_header(head)
+            if header:
+                return head, header
+        return head, None
+
+    try:
+        head, header = call_with_deadline(read_header, deadline)
+    except TimeoutError:
+        response.close()
+        raise SpeechError('No audio received')
+    if not header:
+        raise SpeechError('No response received')
+    params, offset = header
+    rate, width, channels = params
+    frame_size = width * channels
+
+    def on_stall():
+        print('Download of "%s" stalled, ending it' % s)
+        response.close()
+
+    ring = RingBuffer(10 * rate * frame_size, frame_size, stall_timeout=stall,
+                      on_stall=on_stall)
+    pcm = [head[offset:]]
+    ring.write(pcm[0])
+
+    def fill():
+        complete = False
+        try:
+            for chunk in chunks:
+                if ring.closed: # stalled
+                    break
+                ring.write(chunk)
+                pcm.append(chunk)
+            else:
+                complete = True
+        except Exception:
+            if not ring.closed: # closing a stalled response may raise
+                raise
+        finally:
+            ring.close()
+        if complete:
+            cache.put(voice, s, _encode(params, b''.join(pcm)))
+
+    t = Thread(target=fill)
+    t.daemon = True
+    t.start()
+    ring.wait(int(prebuffer * rate) * frame_size, timeout=5)
+    silence = b'\0' * frame_size
+    return params, lambda n: ring.read(n, pad=silence)
+
+def _open_stream(s, voice):
+    """Request the synthesis of `s` without waiting for the response body
+    """
+    return tts.request(method='POST', url='/v1/synthesize', stream=True,
+                       params={'voice': voice, 'accept': 'audio/wav'},
+                       json={'text': s})
+
+def _parse_wav_header(data):
+    """Parse the header at the start of the WAV data `data`
+
+    Returns: {tuple} The (rate, sample width, channels) of the audio and the
+             offset of the PCM data, or None if `data` doesn't hold the whole
+             header yet
+    """
+    if len(data) < 12:
+        return None
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise SpeechError('Not WAV audio')
+    params = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size, = struct.unpack_from('<I', data, pos + 4)
+        if chunk_id == b'data':
+            if params is None:
+                raise SpeechError('WAV audio has no format chunk')
+            return params, pos + 8
+        if pos + 8 + size > len(data):
+            return None
+        if chunk_id == b'fmt ':
+            channels, rate = struct.unpack_from('<HI', data, pos + 10)
+            bits, = struct.unpack_from('<H', data, pos + 22)
+            params = (rate, bits // 8, channels)
+        pos += 8 + size + (size & 1) # chunks are word aligned
+    return None
+
+def _encode(params, pcm):
+    """Returns WAV audio of the PCM data `pcm` with format
+    (rate, sample width, channels)
+    """
+    f = StringIO()
+    wf = wave.open(f, 'wb')
+    wf.setframerate(params[0])
+    wf.setsampwidth(params[1])
+    wf.setnchannels(params[2])
+    wf.writeframes(pcm)
+    wf.close()
+    return f.getvalue()
+
+def _decode(audio):
+    """Returns the (rate, sample width, channels) and PCM data of WAV audio
+    """
     with StringIO(audio) as f:
         wf = wave.open(f, 'rb')
-        p = pyaudio.PyAudio()
-        stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                        channels=wf.getnchannels(),
-                        rate=wf.getframerate(),
-                        output=True,
-                        stream_callback=callback)
-
-        click()
-        stream.start_stream()
-        while stream.is_active():
-            time.sleep(0.1)
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        click()
+        params = (wf.getframerate(), wf.getsampwidth(), wf.getnchannels())
+        return params, wf.readframes(wf.getnframes())
+
+def _crossfade(pieces, rate, width, channels, ms=15):
+    """Join the PCM data in `pieces`, overlapping neighbours by `ms`
+    milliseconds with a linear crossfade so the seams don't click
+    """
+    if width != 2 or len(pieces) < 2: # only 16 bit audio is blended
+        return b''.join(pieces)
+    n = int(rate * ms / 1000.)
+    out = np.frombuffer(pieces[0], dtype=np.int16).reshape(-1, channels)
+    for pcm in pieces[1:]:
+        nxt = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels)
+        k = min(n, len(out), len(nxt))
+        if k:
+            ramp = np.linspace(0., 1., k).reshape(-1, 1)
+            blend = out[-k:] * (1. - ramp) + nxt[:k] * ramp
+            out = np.concatenate([out[:-k], blend.astype(np.int16), nxt[k:]])
+        else:
+            out = np.concatenate([out, nxt])
+    return out.tobytes()
 
 def wrap_text(s, t=None):
     """Wrap a string `s` with speak and express-as tags using type `t`
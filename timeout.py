@@ -1,29 +1,279 @@
-import errno 
+import errno
 import os
-import signal
+import sys
 import time
 
 from functools import wraps
+from threading import Condition, Lock, Thread, local
+from Queue import Queue
+
+_worker = local() # the pool of the current thread, if it is a worker
 
 class TimeoutError(Exception):
-    pass 
+    pass
+
+class CancelledError(Exception):
+    pass
+
+class Future(object):
+    """The pending result of a call submitted to a WorkerPool
+    """
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._done = False
+        self._cancelled = False
+        self._running = False
+        self._abandoned = False # guarded by the pool's lock, see abandon
+        self._released = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        with self._cond:
+            return self._done
+
+    def cancelled(self):
+        with self._cond:
+            return self._cancelled
+
+    def cancel(self):
+        """Cancel the call. A call that hasn't started yet never runs, and the
+        result of a call that is already running is discarded. Python threads
+        can't be interrupted, so a running call still finishes in the
+        background
+        """
+        with self._cond:
+            if self._done:
+                return False
+            self._cancelled = True
+            self._done = True
+            self._cond.notify_all()
+        self._run_callbacks()
+        return True
+
+    def result(self, timeout=None):
+        """Wait up to `timeout` seconds for the call to finish and return its
+        result, re-raising any exception it raised
+
+        Raises: TimeoutError if the call didn't finish in time
+                CancelledError if the call was cancelled
+        """
+        # a worker waiting on another call mustn't hold a place in its pool,
+        # or calls nested past max_workers could never run
+        pool = getattr(_worker, 'pool', None)
+        if pool:
+            pool._block()
+        try:
+            with self._cond:
+                if not self._done:
+                    self._wait(timeout)
+                if not self._done:
+                    raise TimeoutError(os.strerror(errno.ETIME))
+                if self._cancelled:
+                    raise CancelledError()
+                if self._exc_info:
+                    raise self._exc_info[0], self._exc_info[1], \
+                        self._exc_info[2]
+                return self._result
+        finally:
+            if pool:
+                pool._unblock()
+
+    def add_done_callback(self, fn):
+        """Call `fn` with this future once it is done or cancelled
+        """
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _wait(self, timeout):
+        # Condition.wait(None) can't be interrupted with Ctrl-C in Python 2,
+        # so wait in slices even when there is no timeout
+        end = None if timeout is None else time.time() + timeout
+        while not self._done:
+            remaining = 1. if end is None else end - time.time()
+            if remaining <= 0:
+                break
+            self._cond.wait(min(remaining, 1.))
+
+    def _set_running(self):
+        with self._cond:
+            if self._cancelled:
+                return False
+            self._running = True
+            return True
+
+    def _set_result(self, result=None, exc_info=None):
+        with self._cond:
+            if self._done: # cancelled while running
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            self._cond.notify_all()
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+class WorkerPool(object):
+    """A pool of daemon threads that run submitted calls. Workers are started
+    on demand up to `max_workers`. A worker stuck in a call that was
+    abandoned past its deadline is replaced, and a worker waiting on the
+    result of another call doesn't count towards `max_workers`, so neither
+    hung nor nested calls starve the pool
+    """
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._tasks = Queue()
+        self._lock = Lock()
+        self._n_workers = 0
+        self._n_busy = 0
+        self._n_pending = 0
+        self._n_blocked = 0 # workers waiting on a Future
+
+    def submit(self, f, *args, **kwargs):
+        """Schedule `f(*args, **kwargs)` and return a Future for its result
+        """
+        future = Future()
+        self._tasks.put((future, f, args, kwargs))
+        with self._lock:
+            self._n_pending += 1
+            self._grow()
+        return future
+
+    def abandon(self, future):
+        """Give up on a call that is still running, e.g. past its deadline.
+        Its worker no longer counts towards `max_workers` and a replacement
+        is started if calls are waiting. The worker exits once the call
+        returns
+        """
+        with self._lock:
+            if not future._running or future._abandoned or future._released:
+                return
+            future._abandoned = True
+            self._n_workers -= 1
+            self._n_busy -= 1
+            self._grow()
+
+    def _block(self):
+        with self._lock:
+            self._n_blocked += 1
+            self._grow()
+
+    def _unblock(self):
+        with self._lock:
+            self._n_blocked -= 1
+
+    def _grow(self):
+        # called with the lock held
+        n_idle = self._n_workers - self._n_busy
+        if n_idle < self._n_pending and \
+                self._n_workers - self._n_blocked < self.max_workers:
+            self._n_workers += 1
+            t = Thread(target=self._work)
+            t.daemon = True
+            t.start()
+
+    def _work(self):
+        _worker.pool = self
+        while True:
+            future, f, args, kwargs = self._tasks.get()
+            with self._lock:
+                self._n_pending -= 1
+                self._n_busy += 1
+            if future._set_running():
+                try:
+                    result = f(*args, **kwargs)
+                except BaseException:
+                    future._set_result(exc_info=sys.exc_info())
+                else:
+                    future._set_result(result)
+            with self._lock:
+                if future._abandoned: # replaced, see abandon
+                    return
+                future._released = True
+                self._n_busy -= 1
+                # an extra worker started while others were blocked
+                if self._n_workers - self._n_blocked > self.max_workers:
+                    self._n_workers -= 1
+                    return
+
+pool = WorkerPool()
+
+def call_with_deadline(f, seconds, *args, **kwargs):
+    """Call `f(*args, **kwargs)` on the worker pool and return its result,
+    raising TimeoutError if it takes more than `seconds` seconds. Unlike a
+    SIGALRM based timeout this works from any thread and any number of calls
+    can be in flight at once. A call that misses its deadline keeps running
+    in the background, but on a worker of its own
+    """
+    future = pool.submit(f, *args, **kwargs)
+    try:
+        return future.result(timeout=seconds)
+    except TimeoutError:
+        future.cancel()
+        pool.abandon(future)
+        raise
+
+def retry(f, args=(), kwargs=None, attempts=3, seconds=5, backoff=0.25,
+          factor=2., budget=None, on_timeout=None):
+    """Call `f` with a per-call deadline, retrying with exponential backoff
+    when it times out
+
+    Parameters:
+    f {callable} The function to call
+    args {tuple} The positional arguments to call `f` with
+    kwargs {dict} The keyword arguments to call `f` with
+    attempts {int} The maximum number of calls made
+    seconds {float} The deadline of each call
+    backoff {float} The number of seconds waited before the first retry
+    factor {float} The factor the wait grows by after every retry
+    budget {float} The total number of seconds all attempts may take. None
+                   means no limit besides `attempts`
+    on_timeout {callable} Called with the attempt number whenever a call
+                          times out
+
+    Raises: TimeoutError if every attempt timed out or the budget ran out
+    """
+    kwargs = kwargs or {}
+    end = None if budget is None else time.time() + budget
+    delay = backoff
+    for i in range(attempts):
+        per_call = seconds
+        if end is not None:
+            per_call = min(per_call, end - time.time())
+            if per_call <= 0:
+                break
+        try:
+            return call_with_deadline(f, per_call, *args, **kwargs)
+        except TimeoutError:
+            if on_timeout:
+                on_timeout(i)
+        if i < attempts - 1:
+            if end is not None:
+                delay = min(delay, max(0, end - time.time()))
+            time.sleep(delay)
+            delay *= factor
+    raise TimeoutError(os.strerror(errno.ETIME))
 
-# NB: ONLY WORKS ON UNIX SYSTEMS
 def timeout_decorate(f, seconds=10, error_message=os.strerror(errno.ETIME)):
     """Wrap a function `f` such that if it takes more than `seconds` seconds to
     execute, an error is raised
     """
-    def _handle_timeout(signum, frame):
-        raise TimeoutError(error_message)
-
     def wrapper(*args, **kwargs):
-        signal.signal(signal.SIGALRM, _handle_timeout)
-        signal.alarm(seconds)
         try:
-            result = f(*args, **kwargs)
-        finally:
-            signal.alarm(0)
-        return result
+            return call_with_deadline(f, seconds, *args, **kwargs)
+        except TimeoutError:
+            raise TimeoutError(error_message)
 
     return wraps(f)(wrapper)
 
@@ -57,9 +307,40 @@ def main():
         pass
     else:
         raise RuntimeError('Timeout error not raised')
-        
 
-if __name__ == '__main__':
-    main()
+    # calls overlap and can be made off the main thread
+    start = time.time()
+    threads = [Thread(target=lambda: call_with_deadline(time.sleep, 2, 1))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if time.time() - start > 2:
+        raise RuntimeError('Calls did not run concurrently')
+    print('test passed, calls ran concurrently')
+
+    # calls that hang past their deadline don't take the pool's workers
+    for _ in range(2 * pool.max_workers):
+        try:
+            call_with_deadline(time.sleep, 0.05, 3)
+        except TimeoutError:
+            pass
+    start = time.time()
+    call_with_deadline(time.sleep, 1, 0)
+    if time.time() - start > 0.5:
+        raise RuntimeError('Hung calls starved the pool')
+    print('test passed, hung calls were replaced')
+
+    # calls on the pool that make deadline calls of their own
+    def outer():
+        return call_with_deadline(lambda: 'inner', 1)
+    futures = [pool.submit(outer) for _ in range(2 * pool.max_workers)]
+    if [f.result(timeout=2) for f in futures] != \
+            ['inner'] * len(futures):
+        raise RuntimeError('Nested calls did not run')
+    print('test passed, nested calls ran')
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import string
+import sys
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'tts_cache')
+
+class AudioCache(object):
+    """An on-disk cache of synthesized audio. Each entry is a file named after
+    the hash of the voice and the (SSML) text it was synthesized from
+    """
+
+    def __init__(self, path=CACHE_DIR, ext='.wav'):
+        self.path = path
+        self.ext = ext
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(*key))
+
+    def get(self, voice, text):
+        """Returns the cached audio for `text` spoken by `voice`, or None
+        """
+        try:
+            with open(self._path(voice, text), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def put(self, voice, text, audio):
+        """Caches the audio `audio` of `text` spoken by `voice`
+        """
+        path = self._path(voice, text)
+        # write to a temporary file first so a reader never sees half a file
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        if os.path.exists(path):
+            os.remove(path) # os.rename doesn't overwrite on Windows
+        os.rename(tmp_path, path)
+
+    def _path(self, voice, text):
+        text = speech_key(text)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        digest = hashlib.sha1(voice + '\0' + text).hexdigest()
+        return os.path.join(self.path, digest + self.ext)
+
+def speech_key(text):
+    """Returns `text` as it is cached. Whitespace around text isn't spoken,
+    so e.g. a template fragment and the same fragment as
+    text_to_speech.template_pieces strips it share an entry
+    """
+    return text.strip()
+
+def is_static(template):
+    """Whether the format string `template` has no replacement fields, i.e.
+    it is spoken the same way whatever the context
+    """
+    return all(field is None for _, field, _, _ in
+               string.Formatter().parse(template))
+
+def is_speakable(text):
+    """Whether `text` has anything to say, as opposed to bare punctuation
+    left between two replacement fields
+    """
+    return any(c.isalnum() for c in text)
+
+def static_messages(story):
+    """Returns the context independent messages `story` can say: say actions
+    without replacement fields and the fail messages of listen actions
+    """
+    messages = []
+    for node in story.nodes():
+        for action in story.get_actions(node) or []:
+            kwargs = action['kwargs']
+            if action['type'] == 'say' and is_static(kwargs['message']):
+                messages.append(kwargs['message'].format())
+            elif action['type'] == 'listen' and kwargs.get('fail_message'):
+                messages.append(kwargs['fail_message'])
+    return messages
+
+def template_fragments(story):
+    """Returns the pieces text_to_speech.speak_template synthesizes for the
+    say actions of `story` that have replacement fields: the text between the
+    fields and every value a field can take. A field filled by a listen
+    action verified against a context list can take any value in that list,
+    other fields take their current value
+    """
+    formatter = string.Formatter()
+    formatted = story.format_context()
+    domains = {}
+    for node in story.nodes():
+        for action in story.get_actions(node) or []:
+            kwargs = action['kwargs']
+            values = story.get_context(kwargs.get('verify_with'))
+            if action['type'] == 'listen' and kwargs.get('context_key') and \
+                    type(values) is list:
+                if values and type(values[0]) is int: # englishify option
+                    values = values[1:]
+                domains.setdefault(kwargs['context_key'], set()).update(values)
+
+    fragments = set()
+    for node in story.nodes():
+        for action in story.get_actions(node) or []:
+            if action['type'] != 'say' or is_static(action['kwargs']['message']):
+                continue
+            for literal, field, _, _ in formatter.parse(action['kwargs']['message']):
+                fragments.add(literal.strip())
+                if field in domains:
+                    fragments.update(unicode(v).strip() for v in domains[field])
+                elif formatted.get(field) is not None:
+                    fragments.add(unicode(formatted[field]).strip())
+    return sorted(f for f in fragments if is_speakable(f))
+
+def warm_up(messages, synthesize):
+    """Synthesize every message in `messages` with `synthesize` so later calls
+    are served from the cache
+
+    Returns: {int} The number of messages synthesized
+    """
+    n = 0
+    for message in set(speech_key(m) for m in messages):
+        synthesize(message)
+        n += 1
+    return n
+
+def main():
+    """Pre-render the static messages of the stories given on the command
+    line, e.g. `python tts_cache.py movie zoo`. A story is a story module or
+    a module:function factory, see story.load_factory
+    """
+    import story
+    from text_to_speech import synthesize, synthesize_pcm
+
+    names = sys.argv[1:] or ['movie']
+    messages = list(story.FIXED_MESSAGES)
+    fragments = []
+    for name in names:
+        s = story.load_factory(name)()
+        messages += static_messages(s)
+        fragments += template_fragments(s)
+    n = warm_up(messages, synthesize)
+    n_fragments = warm_up(fragments, synthesize_pcm)
+    print('Cached %d messages and %d template fragments in %s' %
+          (n, n_fragments, CACHE_DIR))
+
+if __name__ == '__main__':
+    main()
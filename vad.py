@@ -0,0 +1,90 @@
+import audioop
+
+try:
+    import webrtcvad
+except ImportError: # fall back to energy and zero crossings
+    webrtcvad = None
+
+FRAME_MS = 30 # webrtcvad accepts 10, 20 or 30 ms frames
+VAD_RATES = (8000, 16000, 32000, 48000)
+
+class VoiceDetector(object):
+    """Decides whether recorded audio contains speech, so silence and noise
+    can be thrown away before it is sent to a recognizer. Uses webrtcvad when
+    it is installed, otherwise frames loud enough to be above the energy
+    threshold and with the low zero-crossing rate of voiced speech
+    """
+
+    def __init__(self, aggressiveness=2, energy_threshold=300, max_zcr=0.35,
+            min_speech=0.15, padding=0.2):
+        """Constructor for VoiceDetector
+
+        Parameters:
+        aggressiveness {int} The webrtcvad mode from 0 to 3. Higher filters
+                             out more non-speech
+        energy_threshold {float} The RMS a frame must exceed to be speech
+                                 when webrtcvad isn't available
+        max_zcr {float} The largest fraction of samples crossing zero in a
+                        speech frame. Hiss and fan noise cross far more often
+        min_speech {float} The number of seconds of speech frames audio must
+                           have to be speech
+        padding {float} The number of seconds kept around the speech when
+                        trimming
+        """
+        self.energy_threshold = energy_threshold
+        self.max_zcr = max_zcr
+        self.min_speech = min_speech
+        self.padding = padding
+        self._vad = webrtcvad.Vad(aggressiveness) if webrtcvad else None
+
+    def voiced(self, frame_data, rate, width, energy_threshold=None):
+        """Returns a list with whether each FRAME_MS frame of the mono PCM
+        audio `frame_data` is speech
+        """
+        if energy_threshold is None:
+            energy_threshold = self.energy_threshold
+        if width != 2:
+            frame_data = audioop.lin2lin(frame_data, width, 2)
+        if self._vad and rate not in VAD_RATES:
+            frame_data, _ = audioop.ratecv(frame_data, 2, 1, rate, 16000, None)
+            rate = 16000
+        frame_bytes = rate * FRAME_MS // 1000 * 2
+        flags = []
+        for i in range(0, len(frame_data) - frame_bytes + 1, frame_bytes):
+            frame = frame_data[i:i + frame_bytes]
+            if self._vad:
+                flags.append(self._vad.is_speech(frame, rate))
+            else:
+                zcr = audioop.cross(frame, 2) / (frame_bytes / 2.)
+                flags.append(audioop.rms(frame, 2) > energy_threshold and
+                             zcr < self.max_zcr)
+        return flags
+
+    def is_speech(self, audio, energy_threshold=None):
+        """Whether the sr.AudioData `audio` has at least `min_speech` seconds
+        of speech
+        """
+        flags = self.voiced(audio.frame_data, audio.sample_rate,
+                            audio.sample_width, energy_threshold)
+        return sum(flags) * FRAME_MS / 1000. >= self.min_speech
+
+    def trim(self, audio, energy_threshold=None):
+        """Returns `audio` without the non-speech before and after the
+        speech, keeping `padding` seconds on either side
+        """
+        flags = self.voiced(audio.frame_data, audio.sample_rate,
+                            audio.sample_width, energy_threshold)
+        if not any(flags):
+            return audio
+        first = flags.index(True)
+        last = len(flags) - flags[::-1].index(True)
+        pad = int(self.padding * 1000 / FRAME_MS)
+        # frame boundaries in the original audio, which may differ in rate
+        # and width from what was analyzed
+        frame_bytes = audio.sample_rate * FRAME_MS // 1000 * audio.sample_width
+        start = max(0, first - pad) * frame_bytes
+        end = min(len(flags), last + pad) * frame_bytes
+        if last + pad >= len(flags):
+            end = len(audio.frame_data)
+        return audio.__class__(audio.frame_data[start:end], audio.sample_rate,
+                               audio.sample_width)
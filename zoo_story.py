@@ -28,7 +28,7 @@ def zoo_story_factory():
     s.add_edges_from(dir_edges)
     s.add_undirected_edges_from(undir_edges)
 
-    s.node[actions.entrance]['dynamic_events'][actions.wallet] = 0.01
+    s.add_dynamic_event(actions.entrance, actions.wallet, 0.01)
 
     context = {'name': None,
                'remaining': [e.__name__ for e in exhibits]}